@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AssociationsConfig(AppConfig):
     name = 'associations'
+
+    def ready(self):
+        from . import signals  # noqa: F401
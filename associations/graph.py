@@ -0,0 +1,251 @@
+'''
+In-memory snapshots of the associations of a kind, for analytics that
+would otherwise run many linked and related queries
+'''
+
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from .models import Association
+from .models import AssociationKind
+
+
+class Adjacency(object):
+    '''
+    Compressed sparse row adjacency: the neighbours of nodes[i] are
+    targets[offsets[i]:offsets[i + 1]]. All three are arrays of
+    machine integers; nodes is sorted for bisection.
+    '''
+    def __init__(self, sources, targets):
+        self.nodes = array('q', sorted(set(sources)))
+        counts = array('q', bytes(8 * len(self.nodes)))
+        rows = array('q', bytes(8 * len(sources)))
+        for i, source in enumerate(sources):
+            row = bisect_left(self.nodes, source)
+            rows[i] = row
+            counts[row] += 1
+
+        self.offsets = array('q', [0])
+        for count in counts:
+            self.offsets.append(self.offsets[-1] + count)
+        fill = array('q', self.offsets[:-1])
+        self.targets = array('q', bytes(8 * len(targets)))
+        for i, target in enumerate(targets):
+            self.targets[fill[rows[i]]] = target
+            fill[rows[i]] += 1
+
+    def merged(self, sources, targets):
+        '''
+        Returns a new adjacency with the edges (sources[i], targets[i])
+        appended to the rows of their sources, as a rebuild from all
+        the edges in order would give. Only the new edges are grouped
+        in Python; the rows between them are copied as array slices,
+        with one addition per row to shift their offsets.
+        '''
+        added = {}
+        for source, target in zip(sources, targets):
+            added.setdefault(source, array('q')).append(target)
+
+        nodes = array('q')
+        offsets = array('q', [0])
+        out = array('q')
+
+        def copy(start, stop):
+            # old rows start to stop, which gain no edges
+            shift = len(out) - self.offsets[start]
+            nodes.extend(self.nodes[start:stop])
+            out.extend(self.targets[self.offsets[start]:self.offsets[stop]])
+            if shift:
+                offsets.extend(offset + shift
+                               for offset in self.offsets[start + 1:stop + 1])
+            else:
+                offsets.extend(self.offsets[start + 1:stop + 1])
+
+        row = 0
+        for node in sorted(added):
+            position = bisect_left(self.nodes, node)
+            if position > row:
+                copy(row, position)
+                row = position
+            nodes.append(node)
+            if row < len(self.nodes) and self.nodes[row] == node:
+                out.extend(self.targets[
+                    self.offsets[row]:self.offsets[row + 1]])
+                row += 1
+            out.extend(added[node])
+            offsets.append(len(out))
+        if row < len(self.nodes):
+            copy(row, len(self.nodes))
+
+        adjacency = Adjacency((), ())
+        adjacency.nodes, adjacency.offsets, adjacency.targets = \
+            nodes, offsets, out
+        return adjacency
+
+    def _row(self, node):
+        row = bisect_left(self.nodes, node)
+        if row < len(self.nodes) and self.nodes[row] == node:
+            return row
+        return None
+
+    def neighbours(self, node):
+        row = self._row(node)
+        if row is None:
+            return array('q')
+        return self.targets[self.offsets[row]:self.offsets[row + 1]]
+
+    def degree(self, node):
+        row = self._row(node)
+        if row is None:
+            return 0
+        return self.offsets[row + 1] - self.offsets[row]
+
+
+class KindGraph(object):
+    '''
+    Snapshot of the associations of one kind as left and right ids,
+    with CSR adjacency in both directions. Sides follow get_linked:
+    neighbours(node, 'left') are the right ids linked to the left id
+    node. refresh() adds the associations created since the snapshot;
+    deletions are only seen by loading a new one.
+    '''
+    def __init__(self, kind):
+        self.kind = AssociationKind.objects.resolve(kind)
+        self.high_water = 0
+        self.lefts = array('q')
+        self.rights = array('q')
+        self._build()
+
+    @classmethod
+    def load(cls, kind, using=None, chunk_size=10000):
+        '''
+        Returns a snapshot of kind read with one streamed query.
+        '''
+        graph = cls(kind)
+        graph.refresh(using=using, chunk_size=chunk_size)
+        return graph
+
+    def refresh(self, using=None, chunk_size=10000):
+        '''
+        Reads the associations with ids above the high-water mark and
+        merges them into the adjacency; returns how many were added.
+        Python work is in the new associations and the nodes, while
+        the existing edges are only copied as arrays.
+        '''
+        rows = Association.objects.using(using).filter(
+            kind=self.kind, id__gt=self.high_water).order_by(
+                'id').values_list('id', 'left_id', 'right_id')
+        lefts = array('q')
+        rights = array('q')
+        for pk, left_id, right_id in rows.iterator(chunk_size=chunk_size):
+            lefts.append(left_id)
+            rights.append(right_id)
+            self.high_water = pk
+        if lefts:
+            self.lefts.extend(lefts)
+            self.rights.extend(rights)
+            self._adjacency = {
+                'left': self._adjacency['left'].merged(lefts, rights),
+                'right': self._adjacency['right'].merged(rights, lefts),
+            }
+        return len(lefts)
+
+    def _build(self):
+        self._adjacency = {
+            'left': Adjacency(self.lefts, self.rights),
+            'right': Adjacency(self.rights, self.lefts),
+        }
+
+    def _side(self, side):
+        try:
+            return self._adjacency[side]
+        except KeyError:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+
+    def __len__(self):
+        return len(self.lefts)
+
+    def neighbours(self, node, side='left'):
+        '''
+        Returns an array of the ids linked to node, node being on side.
+        '''
+        return self._side(side).neighbours(node)
+
+    def degree(self, node, side='left'):
+        return self._side(side).degree(node)
+
+    def related(self, node, side='left'):
+        '''
+        Returns a Counter of the ids related to node, as get_related,
+        with the number of items each shares with node.
+        '''
+        other = 'right' if side == 'left' else 'left'
+        shared = Counter()
+        for middle in self.neighbours(node, side):
+            shared.update(self._side(other).neighbours(middle))
+        shared.pop(node, None)
+        return shared
+
+    def bfs(self, node, side='left', max_depth=None):
+        '''
+        Returns a dictionary of the ids reached from node following the
+        kind from side repeatedly, as traverse, mapped to their depth.
+        Only for kinds linking a model to itself.
+        '''
+        if self.kind.left_type_id != self.kind.right_type_id:
+            raise AttributeError(
+                "kind %s does not link a model to itself" %
+                (self.kind.name, ))
+        adjacency = self._side(side)
+        depths = {node: 0}
+        frontier = [node]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            reached = []
+            for current in frontier:
+                for neighbour in adjacency.neighbours(current):
+                    if neighbour not in depths:
+                        depths[neighbour] = depth
+                        reached.append(neighbour)
+            frontier = reached
+        del depths[node]
+        return depths
+
+    def cooccurrence(self, side='left', block_size=1000):
+        '''
+        Yields the rows of the co-occurrence matrix A.At, A being the
+        incidence matrix of the nodes on side, in blocks of block_size
+        rows: lists of (node, Counter of related id -> shared count).
+        Each row is accumulated sparsely from the node's two-hop
+        neighbourhood, so memory is bounded by one block.
+        '''
+        adjacency = self._side(side)
+        other = self._side('right' if side == 'left' else 'left')
+        for start in range(0, len(adjacency.nodes), block_size):
+            block = []
+            for row in range(start, min(start + block_size,
+                                        len(adjacency.nodes))):
+                node = adjacency.nodes[row]
+                shared = Counter()
+                for middle in adjacency.targets[
+                        adjacency.offsets[row]:adjacency.offsets[row + 1]]:
+                    shared.update(other.neighbours(middle))
+                del shared[node]
+                block.append((node, shared))
+            yield block
+
+    def top_related(self, side='left', k=10, block_size=1000):
+        '''
+        Yields (node, [(related id, shared count), ...]) for every node
+        on side with its k most related ids, most shared first and ties
+        by id; a single pass over the co-occurrence matrix.
+        '''
+        for block in self.cooccurrence(side, block_size):
+            for node, shared in block:
+                yield node, heapq.nsmallest(
+                    k, shared.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,169 @@
+'''
+Instrumentation of association operations: the number of queries,
+wall time and rows of each define, linked, related and delete call.
+
+Results are sent with the operation_finished signal, logged to the
+"associations" logger at DEBUG level, passed to the callable named by
+the ASSOCIATIONS_STATS_HOOK setting and collected by record(). When
+none of these is in use the operations run uninstrumented.
+
+Query counts only include the queries run by the call itself; linked
+and related return lazy query sets whose own query runs later.
+'''
+
+import contextvars
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('associations')
+
+# sent with operation, queries, duration (seconds), rows and using
+operation_finished = Signal()
+
+_recorders = contextvars.ContextVar('associations_recorders', default=())
+_running = contextvars.ContextVar('associations_running', default=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _hook(path):
+    return import_string(path)
+
+
+def _active():
+    return bool(_recorders.get() or operation_finished.receivers or
+                getattr(settings, 'ASSOCIATIONS_STATS_HOOK', None) or
+                logger.isEnabledFor(logging.DEBUG))
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _rows(operation, result):
+    # rows returned, or changed, by an operation; None for lazy query
+    # sets and for counts, whose value is not a number of rows
+    if isinstance(result, bool):
+        return int(result)
+    if isinstance(result, int):
+        return None if operation == 'count' else result
+    if isinstance(result, tuple):
+        # (created, existing) counts, or a page of items and its cursor
+        return sum(len(value) if isinstance(value, list) else value
+                   for value in result if isinstance(value, (int, list)))
+    if isinstance(result, dict):
+        # items by pk, or lists of linked items by pk
+        return sum(len(value) if isinstance(value, list) else 1
+                   for value in result.values())
+    if hasattr(result, '_meta'):
+        return 1
+    return None
+
+
+def report(operation, queries, duration, rows, using):
+    stats = dict(operation=operation, queries=queries, duration=duration,
+                 rows=rows, using=using)
+    for recorder in _recorders.get():
+        recorder.append(stats)
+    path = getattr(settings, 'ASSOCIATIONS_STATS_HOOK', None)
+    if path:
+        _hook(path)(**stats)
+    logger.debug('%(operation)s: %(queries)d queries, %(duration).6fs, '
+                 '%(rows)s rows', stats)
+    operation_finished.send(sender=None, **stats)
+
+
+def instrumented(operation):
+    '''
+    Decorates a manager method to report it as operation. Operations
+    called from within another one are part of the outer one.
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(manager, *args, **kwargs):
+            if _running.get() or not _active():
+                return method(manager, *args, **kwargs)
+            # the queries run on the database given by using, if any
+            using = kwargs.get('using') or manager.db
+            token = _running.set(True)
+            counter = QueryCounter()
+            start = time.perf_counter()
+            try:
+                with connections[using].execute_wrapper(counter):
+                    result = method(manager, *args, **kwargs)
+            finally:
+                _running.reset(token)
+            report(operation, counter.count, time.perf_counter() - start,
+                   _rows(operation, result), using)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def record():
+    '''
+    Collects the stats of the operations run inside the block into the
+    list it yields, one dictionary per operation.
+    '''
+    stats = []
+    token = _recorders.set(_recorders.get() + (stats, ))
+    try:
+        yield stats
+    finally:
+        _recorders.reset(token)
+
+
+def summarize(stats):
+    '''
+    Totals a list of operation stats per operation.
+    '''
+    summary = {}
+    for item in stats:
+        total = summary.setdefault(item['operation'], dict(
+            calls=0, queries=0, duration=0.0, rows=0))
+        total['calls'] += 1
+        total['queries'] += item['queries']
+        total['duration'] += item['duration']
+        total['rows'] += item['rows'] or 0
+    return summary
+
+
+class AssociationStatsMiddleware(object):
+    '''
+    Records the association operations of each request, attaches
+    their summary to the request as association_stats and logs it.
+    An operation called more than ASSOCIATIONS_STATS_REPEAT_WARNING
+    times (default 10) in one request is logged as a warning, as it is
+    likely an N+1 pattern that get_linked_many or prefetching avoids.
+    '''
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record() as stats:
+            response = self.get_response(request)
+        if stats:
+            summary = summarize(stats)
+            request.association_stats = summary
+            limit = getattr(settings, 'ASSOCIATIONS_STATS_REPEAT_WARNING',
+                            10)
+            for operation, total in sorted(summary.items()):
+                level = logging.WARNING if total['calls'] > limit \
+                    else logging.INFO
+                logger.log(level, '%s %s: %s x%d, %d queries, %.6fs',
+                           request.method, request.path, operation,
+                           total['calls'], total['queries'],
+                           total['duration'])
+        return response
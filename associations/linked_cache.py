@@ -0,0 +1,88 @@
+'''
+Optional cache of the ids linked to an item, kept in Django's cache
+framework. Enabled by setting ASSOCIATIONS_LINKED_CACHE to the alias
+of the cache to use; ASSOCIATIONS_LINKED_CACHE_TIMEOUT sets the
+timeout of the entries (default: the cache's own).
+'''
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def get_cache():
+    '''
+    Returns the cache holding linked ids, or None when disabled.
+    '''
+    alias = getattr(settings, 'ASSOCIATIONS_LINKED_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def make_key(kind_id, side, object_id):
+    return 'associations:linked:%s:%s:%s' % (kind_id, side, object_id)
+
+
+def _count(name, n=1):
+    with _lock:
+        _stats[name] += n
+
+
+def get_ids(kind, side, object_id, load):
+    '''
+    Returns the list of ids linked to object_id via kind, object_id
+    being on side; on a miss load() computes it and it is cached.
+    '''
+    cache = get_cache()
+    key = make_key(kind.id, side, object_id)
+    ids = cache.get(key)
+    if ids is not None:
+        _count('hits')
+        return ids
+    _count('misses')
+    ids = list(load())
+    if hasattr(settings, 'ASSOCIATIONS_LINKED_CACHE_TIMEOUT'):
+        cache.set(key, ids, settings.ASSOCIATIONS_LINKED_CACHE_TIMEOUT)
+    else:
+        cache.set(key, ids)
+    return ids
+
+
+def invalidate(kind, id_pairs, using=None):
+    '''
+    Drops the cached ids of both ends of the associations of kind
+    between id_pairs; again on commit, so that entries cached from
+    inside the transaction do not outlive it.
+    '''
+    cache = get_cache()
+    if cache is None:
+        return
+    keys = set()
+    for left_id, right_id in id_pairs:
+        keys.add(make_key(kind.id, 'left', left_id))
+        keys.add(make_key(kind.id, 'right', right_id))
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+    _count('invalidations', len(keys))
+
+
+def stats():
+    '''
+    Returns the hit, miss and invalidation counters of this process.
+    '''
+    with _lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,210 @@
+import json
+import math
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from associations.instrumentation import QueryCounter
+from associations.models import Association
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Times association operations on synthetic graphs of ' \
+           'increasing size and writes the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sizes', nargs='*', type=int, default=[1000, 10000, 100000],
+            help='number of associations of each graph; default 1000 '
+                 '10000 100000')
+        parser.add_argument(
+            '--database', default='default',
+            help='database to run against; use a scratch database')
+        parser.add_argument(
+            '--model', default='tests.Person',
+            help='app_label.Model linked on both sides; instances are '
+                 'created with default field values')
+        parser.add_argument(
+            '--samples', type=int, default=100,
+            help='number of calls timed per operation and graph')
+        parser.add_argument(
+            '--fanout', type=int, default=10,
+            help='average number of associations per item')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='batch size of define_many and of item creation')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '-o', '--output',
+            help='file to write the results to; default standard output')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='keep the kinds, associations and items created')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError):
+            raise CommandError('no model %s' % options['model'])
+        using = options['database']
+        if using not in connections:
+            raise CommandError('no database %s' % using)
+        random.seed(options['seed'])
+
+        runs = []
+        for edges in options['sizes']:
+            runs.append(self.run(model, using, edges, options))
+
+        result = dict(
+            vendor=connections[using].vendor,
+            database=using,
+            model=model._meta.label,
+            python=platform.python_version(),
+            django=django.get_version(),
+            seed=options['seed'],
+            samples=options['samples'],
+            runs=runs)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                json.dump(result, out, indent=2)
+        else:
+            self.stdout.write(json.dumps(result, indent=2))
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def run(self, model, using, edges, options):
+        name = 'benchmark%d' % edges
+        if AssociationKind.objects.db_manager(using).filter(
+                name=name).exists():
+            raise CommandError('kind %s exists; run with a scratch '
+                               'database or delete it' % name)
+        kind = AssociationKind.objects.db_manager(using).define(
+            name, model, model)
+        manager = Association.objects.db_manager(using)
+
+        # at least twice as many possible pairs as associations, so
+        # random pairs keep finding new ones
+        nodes = max(edges // options['fanout'],
+                    math.isqrt(max(2 * edges - 1, 0)) + 1, 2)
+        # spare items are never linked while loading, so that timed
+        # define and save calls always create a new association
+        items = self.create(model, using, nodes + options['samples'],
+                            options['batch_size'])
+        try:
+            spare = items[nodes:]
+            items = items[:nodes]
+
+            self.log('%s: loading %d associations between %d items' % (
+                name, edges, nodes))
+            load = self.load(manager, kind, items, edges,
+                             options['batch_size'])
+            self.log('%s: loaded in %.1fs' % (name, load['seconds']))
+
+            lefts = random.sample(items, min(options['samples'], nodes))
+            operations = self.measure(manager, kind, lefts, spare, using)
+        finally:
+            if not options['keep']:
+                self.clean(model, using, kind, items + spare)
+
+        return dict(edges=edges, nodes=nodes, load=load,
+                    operations=operations)
+
+    def create(self, model, using, count, batch_size):
+        created = []
+        manager = model._default_manager.db_manager(using)
+        for start in range(0, count, batch_size):
+            created.extend(manager.bulk_create(
+                [model() for i in range(min(batch_size, count - start))]))
+        return created
+
+    def load(self, manager, kind, items, edges, batch_size):
+        # left ends follow a power law, so a few items are hubs with
+        # many links; right ends are uniform. Pairs drawn before are
+        # drawn again, so that each batch only holds new associations.
+        count = len(items)
+
+        def pick():
+            return int(random.paretovariate(1.2)) % count
+
+        counter = QueryCounter()
+        created = 0
+        drawn = set()
+        start = time.perf_counter()
+        with connections[manager.db].execute_wrapper(counter):
+            while created < edges:
+                pairs = []
+                for i in range(min(batch_size, edges - created)):
+                    for attempt in range(100 * count):
+                        left, right = pick(), random.randrange(count)
+                        if left * count + right not in drawn:
+                            break
+                    else:
+                        raise CommandError(
+                            'no new associations between %d items after '
+                            '%d; lower --fanout' % (count, created))
+                    drawn.add(left * count + right)
+                    pairs.append((items[left], items[right]))
+                created += manager.define_many(kind, pairs, batch_size)[0]
+        seconds = time.perf_counter() - start
+        return dict(seconds=seconds,
+                    edges_per_second=edges / seconds if seconds else None,
+                    queries=counter.count)
+
+    def measure(self, manager, kind, lefts, spare, using):
+        calls = dict(
+            define=lambda obj, other: manager.define(kind, other, obj),
+            save=lambda obj, other: Association(
+                kind=kind,
+                left_type_id=kind.left_type_id,
+                right_type_id=kind.right_type_id,
+                left_id=obj.pk,
+                right_id=other.pk).save(using=using),
+            linked_left=lambda obj, other: list(manager.get_linked(
+                obj, kind, 'left').using(using)),
+            linked_right=lambda obj, other: list(manager.get_linked(
+                obj, kind, 'right').using(using)),
+            related=lambda obj, other: list(manager.get_related(
+                obj, kind).using(using)),
+        )
+
+        operations = {}
+        for name, call in calls.items():
+            timings = []
+            counter = QueryCounter()
+            with connections[using].execute_wrapper(counter):
+                for obj, other in zip(lefts, spare):
+                    start = time.perf_counter()
+                    call(obj, other)
+                    timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            operations[name] = dict(
+                calls=len(timings),
+                queries=counter.count / len(timings),
+                mean_ms=statistics.mean(timings),
+                p50_ms=timings[len(timings) // 2],
+                p95_ms=timings[max(int(len(timings) * 0.95) - 1, 0)],
+                max_ms=timings[-1])
+            self.log('%s %s: mean %.3fms p95 %.3fms, %.1f queries' % (
+                kind.name, name, operations[name]['mean_ms'],
+                operations[name]['p95_ms'], operations[name]['queries']))
+        return operations
+
+    def clean(self, model, using, kind, items):
+        # raw deletes skip the per-row signals of the associations and
+        # of the items, which would unlink each item one by one
+        Association.objects.db_manager(using).filter(
+            kind=kind)._raw_delete(using)
+        AssociationKind.objects.db_manager(using).filter(
+            pk=kind.pk).delete()
+        pks = [item.pk for item in items]
+        for start in range(0, len(pks), 500):
+            model._default_manager.db_manager(using).filter(
+                pk__in=pks[start:start + 500])._raw_delete(using)
@@ -0,0 +1,111 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from associations.models import Association
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Streams associations out as newline-delimited JSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kinds', nargs='*',
+            help='names of the kinds to export; default all kinds')
+        parser.add_argument(
+            '--format', choices=('ndjson', 'csv'), default='ndjson')
+        parser.add_argument(
+            '-o', '--output',
+            help='file to write; default standard output')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='number of associations read per query')
+        parser.add_argument(
+            '--after-id', type=int, default=0,
+            help='export the associations with a larger id only; the '
+                 'last id exported is reported to resume from')
+        parser.add_argument(
+            '--natural', action='store_true',
+            help='write the natural keys of the linked items instead '
+                 'of their pks (ndjson only)')
+
+    def handle(self, *args, **options):
+        if options['natural'] and options['format'] != 'ndjson':
+            raise CommandError('--natural needs --format ndjson')
+        kinds = []
+        for name in options['kinds']:
+            try:
+                kinds.append(AssociationKind.objects.resolve(name))
+            except AssociationKind.DoesNotExist:
+                raise CommandError('no association kind %s' % name)
+
+        self.skipped = 0
+        if options['output']:
+            with open(options['output'], 'w', newline='') as out:
+                last, count = self.export(out, kinds, options)
+        else:
+            last, count = self.export(self.stdout, kinds, options)
+        self.stderr.write('exported %d associations; last id %d' %
+                          (count, last))
+        if self.skipped:
+            self.stderr.write('skipped %d associations of deleted items; '
+                              'see sweep_associations' % self.skipped)
+
+    def export(self, out, kinds, options):
+        writer = csv.writer(out) if options['format'] == 'csv' else None
+        if writer:
+            writer.writerow(('kind', 'left', 'right'))
+
+        qs = Association.objects.all()
+        if kinds:
+            qs = qs.filter(kind__in=kinds)
+        last = options['after_id']
+        count = 0
+        while True:
+            # keyset pagination; each chunk starts after the last id
+            rows = list(qs.filter(id__gt=last).order_by('id').values_list(
+                'id', 'kind_id', 'left_id', 'right_id')[
+                    :options['chunk_size']])
+            if not rows:
+                return last, count
+            chunk_last = rows[-1][0]
+            if options['natural']:
+                rows = self.natural_keys(rows)
+            for id, kind_id, left, right in rows:
+                name = AssociationKind.objects.resolve(kind_id).name
+                if writer:
+                    writer.writerow((name, left, right))
+                else:
+                    out.write(json.dumps(
+                        dict(kind=name, left=left, right=right)) + '\n')
+            last = chunk_last
+            count += len(rows)
+
+    def natural_keys(self, rows):
+        # natural keys of the items of a chunk, one query per model
+        ids = {}
+        for id, kind_id, left_id, right_id in rows:
+            kind = AssociationKind.objects.resolve(kind_id)
+            ids.setdefault(kind.left_model, set()).add(left_id)
+            ids.setdefault(kind.right_model, set()).add(right_id)
+        keys = {}
+        for model, pks in ids.items():
+            if not hasattr(model, 'natural_key'):
+                raise CommandError('%s has no natural key' %
+                                   model._meta.label)
+            for item in model._default_manager.filter(pk__in=pks):
+                keys[(model, item.pk)] = item.natural_key()
+
+        # associations of deleted items have no natural key to write
+        natural = []
+        for id, kind_id, left_id, right_id in rows:
+            kind = AssociationKind.objects.resolve(kind_id)
+            left = keys.get((kind.left_model, left_id))
+            right = keys.get((kind.right_model, right_id))
+            if left is None or right is None:
+                self.skipped += 1
+            else:
+                natural.append((id, kind_id, left, right))
+        return natural
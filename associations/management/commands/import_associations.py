@@ -0,0 +1,130 @@
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router
+
+from associations.models import Association
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Loads associations written by export_associations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='file to read')
+        parser.add_argument(
+            '--format', choices=('ndjson', 'csv'), default='ndjson')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='number of lines inserted per batch')
+        parser.add_argument(
+            '--checkpoint',
+            help='file recording the lines loaded so far; an import '
+                 'interrupted with one resumes after the last batch')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        done = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = int(f.read().strip() or 0)
+
+        created = existing = 0
+        with open(options['input'], newline='') as f:
+            if options['format'] == 'csv':
+                records = csv.DictReader(f)
+            else:
+                records = (json.loads(line) for line in f if line.strip())
+
+            line = 0
+            batch = []
+            for record in records:
+                line += 1
+                if line <= done:
+                    continue
+                batch.append((line, record))
+                if line % options['batch_size'] == 0:
+                    counts = self.flush(batch, options['batch_size'])
+                    created, existing = (created + counts[0],
+                                         existing + counts[1])
+                    self.save_checkpoint(checkpoint, line)
+                    batch = []
+            counts = self.flush(batch, options['batch_size'])
+            created, existing = created + counts[0], existing + counts[1]
+            self.save_checkpoint(checkpoint, max(line, done))
+
+        self.stdout.write('%d associations created, %d already present' %
+                          (created, existing))
+
+    def kind(self, record, line):
+        try:
+            return AssociationKind.objects.resolve(record['kind'])
+        except AssociationKind.DoesNotExist:
+            raise CommandError('line %d: no association kind %s' %
+                               (line, record['kind']))
+
+    def natural_pks(self, keys):
+        # pks of the natural keys of a batch by (model, key): one query
+        # per model when its manager has in_bulk_by_natural_key, one
+        # per distinct key otherwise
+        pks = {}
+        for model, model_keys in keys.items():
+            manager = model._default_manager
+            if hasattr(manager, 'in_bulk_by_natural_key'):
+                items = manager.in_bulk_by_natural_key(list(model_keys))
+                for key, item in items.items():
+                    pks[(model, tuple(key))] = item.pk
+                continue
+            for key in model_keys:
+                try:
+                    pks[(model, key)] = manager.get_by_natural_key(*key).pk
+                except model.DoesNotExist:
+                    pass
+        return pks
+
+    def flush(self, records, batch_size):
+        parsed = []
+        keys = {}
+        for line, record in records:
+            kind = self.kind(record, line)
+            parsed.append((line, kind, record['left'], record['right']))
+            for model, key in ((kind.left_model, record['left']),
+                               (kind.right_model, record['right'])):
+                if isinstance(key, list):
+                    keys.setdefault(model, set()).add(tuple(key))
+        pks = self.natural_pks(keys)
+
+        batch = {}
+        for line, kind, left, right in parsed:
+            batch.setdefault(kind, set()).add(
+                (self.pk(pks, kind.left_model, left, line),
+                 self.pk(pks, kind.right_model, right, line)))
+
+        # bound to the database for writes as define_many is
+        manager = Association.objects.db_manager(
+            router.db_for_write(Association))
+        created = existing = 0
+        for kind, pairs in batch.items():
+            counts = manager._bulk_define(kind, sorted(pairs), batch_size)
+            created, existing = created + counts[0], existing + counts[1]
+        return created, existing
+
+    def pk(self, pks, model, key, line):
+        if isinstance(key, list):
+            try:
+                return pks[(model, tuple(key))]
+            except KeyError:
+                raise CommandError('line %d: no %s with natural key %s' %
+                                   (line, model._meta.label, key))
+        try:
+            return int(key)
+        except (TypeError, ValueError):
+            raise CommandError('line %d: %r is not the pk of a %s' %
+                               (line, key, model._meta.label))
+
+    def save_checkpoint(self, checkpoint, line):
+        if checkpoint:
+            with open(checkpoint, 'w') as f:
+                f.write('%d\n' % line)
@@ -0,0 +1,136 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from associations.models import Association
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Partitions the association table by kind on PostgreSQL, ' \
+           'or adds the partitions of new kinds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default='default',
+            help='database to partition')
+        parser.add_argument(
+            '--execute', action='store_true',
+            help='run the statements instead of printing them')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                'partitioning needs PostgreSQL; %s keeps associations in '
+                'one table' % connection.vendor)
+
+        table = Association._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relkind FROM pg_class c '
+                'WHERE c.oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            if row is None:
+                raise CommandError('no table %s; migrate first' % table)
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = to_regclass(%s)', [table])
+            existing = set(name for name, in cursor.fetchall())
+
+        kinds = list(AssociationKind.objects.using(using).order_by('id'))
+        if row[0] == 'p':
+            statements = self.add_sql(connection, kinds, existing)
+        else:
+            statements = self.convert_sql(connection, kinds)
+
+        if not statements:
+            self.stderr.write('every kind has its partition')
+        elif options['execute']:
+            with transaction.atomic(using=using):
+                with connection.cursor() as cursor:
+                    for sql in statements:
+                        cursor.execute(sql)
+            self.stderr.write('ran %d statements' % len(statements))
+        else:
+            for sql in statements:
+                self.stdout.write(sql + ';')
+
+    def partition(self, suffix):
+        return '%s_%s' % (Association._meta.db_table, suffix)
+
+    def convert_sql(self, connection, kinds):
+        '''
+        Statements replacing the association table with one partitioned
+        by kind: a partition per kind and a default one for kinds
+        defined later, with the rows, keys and indexes of the old table.
+        The primary key becomes (kind_id, id), as the key of a
+        partitioned table must hold the partition column.
+        '''
+        table = Association._meta.db_table
+        qn = connection.ops.quote_name
+        old = self.partition('unpartitioned')
+        statements = [
+            'ALTER TABLE %s RENAME TO %s' % (qn(table), qn(old)),
+            'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING '
+            'IDENTITY INCLUDING CONSTRAINTS) PARTITION BY LIST (%s)' % (
+                qn(table), qn(old), qn('kind_id')),
+        ]
+        for kind in kinds:
+            statements.append(
+                'CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%d)' % (
+                    qn(self.partition(kind.id)), qn(table), kind.id))
+        statements += [
+            'CREATE TABLE %s PARTITION OF %s DEFAULT' % (
+                qn(self.partition('default')), qn(table)),
+            'INSERT INTO %s SELECT * FROM %s' % (qn(table), qn(old)),
+            # drops the old keys and indexes, freeing their names
+            'DROP TABLE %s' % qn(old),
+            'ALTER TABLE %s ADD PRIMARY KEY (%s, %s)' % (
+                qn(table), qn('kind_id'), qn('id')),
+            'ALTER TABLE %s ADD CONSTRAINT %s UNIQUE (%s, %s, %s)' % (
+                qn(table), qn('assoc_kind_left_right_uniq'),
+                qn('kind_id'), qn('left_id'), qn('right_id')),
+            'CREATE INDEX %s ON %s (%s, %s, %s)' % (
+                qn('assoc_kind_right_left_idx'), qn(table),
+                qn('kind_id'), qn('right_id'), qn('left_id')),
+        ]
+        for column, model in (('kind_id', AssociationKind),
+                              ('left_type_id', ContentType),
+                              ('right_type_id', ContentType)):
+            statements.append(
+                'ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s (%s) '
+                'DEFERRABLE INITIALLY DEFERRED' % (
+                    qn(table), qn(column), qn(model._meta.db_table),
+                    qn('id')))
+        statements.append(
+            "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+            "COALESCE(MAX(%s), 0) + 1, false) FROM %s" % (
+                table, qn('id'), qn(table)))
+        return statements
+
+    def add_sql(self, connection, kinds, existing):
+        '''
+        Statements giving each kind without a partition its own, moving
+        its rows out of the default partition.
+        '''
+        table = Association._meta.db_table
+        qn = connection.ops.quote_name
+        default = self.partition('default')
+        statements = []
+        for kind in kinds:
+            partition = self.partition(kind.id)
+            if partition in existing:
+                continue
+            statements += [
+                'CREATE TABLE %s (LIKE %s)' % (qn(partition), qn(table)),
+                'INSERT INTO %s SELECT * FROM %s WHERE %s = %d' % (
+                    qn(partition), qn(default), qn('kind_id'), kind.id),
+                'DELETE FROM %s WHERE %s = %d' % (
+                    qn(default), qn('kind_id'), kind.id),
+                'ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN (%d)' % (
+                    qn(table), qn(partition), kind.id),
+            ]
+        return statements
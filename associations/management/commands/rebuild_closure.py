@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from associations.models import AssociationClosure
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the closure table of association kinds from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kinds', nargs='*',
+            help='names of the kinds to rebuild; default all kinds '
+                 'keeping a closure')
+
+    def handle(self, *args, **options):
+        if options['kinds']:
+            kinds = []
+            for name in options['kinds']:
+                try:
+                    kind = AssociationKind.objects.resolve(name)
+                except AssociationKind.DoesNotExist:
+                    raise CommandError('no association kind %s' % name)
+                if not kind.closure:
+                    raise CommandError('kind %s keeps no closure' % name)
+                kinds.append(kind)
+        else:
+            kinds = AssociationKind.objects.filter(closure=True)
+
+        for kind in kinds:
+            try:
+                count = AssociationClosure.objects.rebuild(kind)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write('%s: %d closure rows' % (kind.name, count))
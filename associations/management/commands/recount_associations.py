@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from associations.models import AssociationCount
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Recounts the associations of kinds keeping counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kinds', nargs='*',
+            help='names of the kinds to recount; default all kinds '
+                 'keeping counts')
+
+    def handle(self, *args, **options):
+        if options['kinds']:
+            kinds = []
+            for name in options['kinds']:
+                try:
+                    kind = AssociationKind.objects.resolve(name)
+                except AssociationKind.DoesNotExist:
+                    raise CommandError('no association kind %s' % name)
+                if not kind.counted:
+                    raise CommandError('kind %s keeps no counts' % name)
+                kinds.append(kind)
+        else:
+            kinds = AssociationKind.objects.filter(counted=True)
+
+        for kind in kinds:
+            count = AssociationCount.objects.recount(kind)
+            self.stdout.write('%s: %d count rows' % (kind.name, count))
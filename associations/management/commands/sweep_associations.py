@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from associations.models import Association
+from associations.models import AssociationKind
+
+
+class Command(BaseCommand):
+    help = 'Deletes associations whose linked items no longer exist.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kinds', nargs='*',
+            help='names of the kinds to sweep; default all kinds')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='number of associations checked per statement')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='count the orphans without deleting them')
+
+    def handle(self, *args, **options):
+        if options['kinds']:
+            kinds = []
+            for name in options['kinds']:
+                try:
+                    kinds.append(AssociationKind.objects.resolve(name))
+                except AssociationKind.DoesNotExist:
+                    raise CommandError('no association kind %s' % name)
+        else:
+            kinds = AssociationKind.objects.all()
+
+        for kind in kinds:
+            for side in ('left', 'right'):
+                found = Association.objects.delete_orphans(
+                    kind, side,
+                    chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'])
+                self.stdout.write('%s %s: %d orphans%s' % (
+                    kind.name, side, found,
+                    '' if options['dry_run'] else ' deleted'))
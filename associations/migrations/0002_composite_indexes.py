@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('associations', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='association',
+            index=models.Index(fields=['kind', 'left_id', 'right_id'], name='assoc_kind_left_right_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='association',
+            index=models.Index(fields=['kind', 'right_id', 'left_id'], name='assoc_kind_right_left_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('associations', '0002_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='associationkind',
+            name='closure',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='AssociationClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_id', models.PositiveIntegerField()),
+                ('descendant_id', models.PositiveIntegerField()),
+                ('depth', models.PositiveIntegerField()),
+                ('paths', models.PositiveIntegerField(default=1)),
+                ('kind', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='associations.associationkind')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'descendant_id', 'ancestor_id'], name='assoc_closure_desc_anc_idx')],
+                'unique_together': {('kind', 'ancestor_id', 'descendant_id', 'depth')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('associations', '0003_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='associationkind',
+            name='counted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='AssociationCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('left', 'left'), ('right', 'right')], max_length=5)),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('kind', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='associations.associationkind')),
+            ],
+            options={
+                'unique_together': {('kind', 'side', 'object_id')},
+            },
+        ),
+    ]
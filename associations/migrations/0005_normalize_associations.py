@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+import logging
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min
+
+logger = logging.getLogger('associations')
+
+
+def _ids(ids):
+    return ', '.join(str(id) for id in ids[:20]) + (
+        ', ...' if len(ids) > 20 else '')
+
+
+def normalize(apps, schema_editor):
+    '''
+    Checks that (kind, left_id, right_id) can be made unique: that no
+    two associations of a kind link the same items and that the types
+    of every association are those of its kind. Otherwise the
+    migration stops with the ids of the associations at fault, unless
+    ASSOCIATIONS_MIGRATE_FIX is set; then the duplicates are deleted,
+    keeping the oldest, the types are set from the kinds and the ids
+    changed are logged. Historical models send no signals, so run
+    rebuild_closure and recount_associations afterwards if any
+    duplicate was deleted.
+    '''
+    Association = apps.get_model('associations', 'Association')
+    AssociationKind = apps.get_model('associations', 'AssociationKind')
+    using = schema_editor.connection.alias
+
+    duplicates = []
+    groups = Association.objects.using(using).order_by().values(
+        'kind', 'left_id', 'right_id').annotate(
+            n=Count('id'), keep=Min('id')).filter(n__gt=1)
+    for row in groups:
+        duplicates.extend(Association.objects.using(using).filter(
+            kind=row['kind'],
+            left_id=row['left_id'],
+            right_id=row['right_id']).exclude(id=row['keep']).values_list(
+                'id', flat=True))
+    mistyped = {}
+    for kind in AssociationKind.objects.using(using):
+        ids = list(Association.objects.using(using).filter(
+            kind=kind).exclude(
+                left_type_id=kind.left_type_id,
+                right_type_id=kind.right_type_id).values_list(
+                    'id', flat=True))
+        if ids:
+            mistyped[kind] = ids
+    if not duplicates and not mistyped:
+        return
+
+    wrong = sorted(id for ids in mistyped.values() for id in ids)
+    if not getattr(settings, 'ASSOCIATIONS_MIGRATE_FIX', False):
+        raise ValueError(
+            '%d associations duplicate older ones of the same kind and '
+            'items (ids %s) and %d have types other than those of their '
+            'kind (ids %s); fix them, or set ASSOCIATIONS_MIGRATE_FIX = '
+            'True to delete the duplicates and set the types from the '
+            'kinds' % (len(duplicates), _ids(duplicates), len(wrong),
+                       _ids(wrong)))
+
+    for start in range(0, len(duplicates), 1000):
+        Association.objects.using(using).filter(
+            id__in=duplicates[start:start + 1000]).delete()
+    if duplicates:
+        logger.warning('deleted %d duplicate associations: %s',
+                       len(duplicates), ', '.join(map(str, duplicates)))
+    for kind, ids in mistyped.items():
+        for start in range(0, len(ids), 1000):
+            Association.objects.using(using).filter(
+                id__in=ids[start:start + 1000]).update(
+                    left_type_id=kind.left_type_id,
+                    right_type_id=kind.right_type_id)
+    if wrong:
+        logger.warning('set the types of %d associations from their '
+                       'kind: %s', len(wrong), ', '.join(map(str, wrong)))
+
+
+class Migration(migrations.Migration):
+    # apart from 0006 so that the rows are fixed and committed before
+    # the table is altered; PostgreSQL refuses to alter a table with
+    # pending trigger events from updates in the same transaction
+
+    dependencies = [
+        ('associations', '0004_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('associations', '0005_normalize_associations'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='association',
+            name='assoc_kind_left_right_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='association',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='association',
+            name='kind',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='associations.associationkind'),
+        ),
+        migrations.AlterField(
+            model_name='association',
+            name='left_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='association',
+            name='left_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='left', to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='association',
+            name='right_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='association',
+            name='right_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='right', to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='associationclosure',
+            name='ancestor_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='associationclosure',
+            name='descendant_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='associationcount',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='association',
+            constraint=models.UniqueConstraint(fields=('kind', 'left_id', 'right_id'), name='assoc_kind_left_right_uniq'),
+        ),
+    ]
@@ -2,12 +2,183 @@
 Models for associations
 '''
 
-from django.db import models
+import contextlib
+import copy
+import functools
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import connections, models, router, transaction
+from django.db.models import Count, Exists, F, FloatField, OuterRef
+from django.db.models import Q, Subquery
+from django.db.models.signals import post_save
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, Sqrt
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
+from . import linked_cache, routers
+from .instrumentation import instrumented
+
+
+class _KindsChanged:
+    # commit hook of a transaction that changed kinds; holds the kinds
+    # it loaded until it commits
+    def __init__(self, manager):
+        self.manager = manager
+        self.entry = None
+
+    def __call__(self):
+        self.manager.clear_cache()
+
 
 class AssociationKindManager(models.Manager):
+    def __init__(self, *args, **kwargs):
+        super(AssociationKindManager, self).__init__(*args, **kwargs)
+        # Cache shared by all the copies of this manager; keyed by
+        # database alias. Each entry holds the kinds by name and by id
+        # along with the time they were loaded.
+        self._cache = {}
+
+    def _store(self, kinds):
+        entry = {
+            'names': {},
+            'ids': {},
+            'loaded': time.monotonic(),
+        }
+        for kind in kinds:
+            entry['names'][kind.name] = kind
+            entry['ids'][kind.id] = kind
+        # kinds changed in a transaction that is still open may yet be
+        # rolled back; keep them with the transaction, not the shared
+        # cache
+        hook = self._hook()
+        if hook is None:
+            self._cache[self.db] = entry
+        else:
+            hook.entry = entry
+        return entry
+
+    def _load(self):
+        return self._store(self.select_related('left_type', 'right_type'))
+
+    async def _aload(self):
+        return self._store([
+            kind async for kind in self.select_related(
+                'left_type', 'right_type')])
+
+    def _hook(self):
+        # the commit hook left by kinds_changed() while a transaction
+        # that changed kinds is open on this database; Django drops it
+        # when the transaction or its savepoint is rolled back
+        connection = connections[self.db]
+        if not connection.in_atomic_block:
+            return None
+        for hook in reversed(connection.run_on_commit):
+            if isinstance(hook[1], _KindsChanged):
+                return hook[1]
+        return None
+
+    def _fresh(self):
+        # the cache entry, unless missing or older than the TTL
+        hook = self._hook()
+        entry = self._cache.get(self.db) if hook is None else hook.entry
+        if entry is None:
+            return None
+        ttl = getattr(settings, 'ASSOCIATIONS_KIND_CACHE_TTL', None)
+        if ttl is not None and time.monotonic() - entry['loaded'] > ttl:
+            return None
+        return entry
+
+    def _cached(self):
+        return self._fresh() or self._load()
+
+    def _key(self, kind):
+        if isinstance(kind, AssociationKind):
+            return 'ids', kind.id
+        elif isinstance(kind, str):
+            return 'names', kind
+        return 'ids', kind
+
+    def _missing(self, kind, key, value):
+        if isinstance(kind, AssociationKind):
+            return kind
+        raise self.model.DoesNotExist(
+            'AssociationKind matching %s=%r does not exist.' %
+            ('name' if key == 'names' else 'id', value))
+
+    def resolve(self, kind):
+        '''
+        Returns the AssociationKind given its name, id or instance.
+        Kinds come from a process-local cache that is filled on first
+        use and holds the left and right content types, so resolving a
+        kind and its model classes does not hit the database. An
+        instance that already holds its content types is returned as
+        is.
+        '''
+        if isinstance(kind, AssociationKind) and\
+           AssociationKind.left_type.is_cached(kind) and\
+           AssociationKind.right_type.is_cached(kind):
+            return kind
+        key, value = self._key(kind)
+
+        try:
+            return self._cached()[key][value]
+        except KeyError:
+            pass
+        # unknown to the cache; the kind may be new
+        try:
+            return self._load()[key][value]
+        except KeyError:
+            return self._missing(kind, key, value)
+
+    async def aresolve(self, kind):
+        '''
+        Async version of resolve().
+        '''
+        if isinstance(kind, AssociationKind) and\
+           AssociationKind.left_type.is_cached(kind) and\
+           AssociationKind.right_type.is_cached(kind):
+            return kind
+        key, value = self._key(kind)
+
+        try:
+            return (self._fresh() or await self._aload())[key][value]
+        except KeyError:
+            pass
+        try:
+            return (await self._aload())[key][value]
+        except KeyError:
+            return self._missing(kind, key, value)
+
+    def cached_kinds(self):
+        '''
+        Returns a list of all the kinds, from the cache.
+        '''
+        return list(self._cached()['ids'].values())
+
+    def clear_cache(self):
+        '''
+        Clears the kind cache.
+        '''
+        self._cache.clear()
+        for connection in connections.all(initialized_only=True):
+            for hook in connection.run_on_commit:
+                if isinstance(hook[1], _KindsChanged):
+                    hook[1].entry = None
+
+    def kinds_changed(self):
+        '''
+        Called whenever a kind is saved or deleted. Clears the kind
+        cache now and again once the transaction commits; until then
+        the kinds loaded are cached for that transaction only, so a
+        rollback leaves nothing stale behind.
+        '''
+        self.clear_cache()
+        transaction.on_commit(_KindsChanged(self), using=self.db)
+
     def define(self, name, left, right):
         left_type = ContentType.objects.get_for_model(left)
         right_type = ContentType.objects.get_for_model(right)
@@ -29,6 +200,12 @@ class AssociationKind(models.Model):
     right_type = models.ForeignKey(ContentType, models.CASCADE,
                                    related_name='rightk')
 
+    # maintain an AssociationClosure table for this kind; only for
+    # kinds linking a model to itself
+    closure = models.BooleanField(default=False)
+    # maintain AssociationCount rows for this kind
+    counted = models.BooleanField(default=False)
+
     objects = AssociationKindManager()
 
     class Meta:
@@ -37,18 +214,53 @@ class AssociationKind(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.closure and self.left_type_id != self.right_type_id:
+            raise ValueError('closure needs a kind linking a model to '
+                             'itself; %s does not' % (self.name, ))
+        super(AssociationKind, self).save(*args, **kwargs)
+
+    @property
+    def left_model(self):
+        return self.left_type.model_class()
+
+    @property
+    def right_model(self):
+        return self.right_type.model_class()
+
+
+def writes(method):
+    '''
+    Runs a manager method that changes associations on a manager bound
+    to the database for writes, so that the reads it makes on the way
+    go to the primary too.
+    '''
+    @functools.wraps(method)
+    def wrapper(manager, *args, **kwargs):
+        if manager._db is None:
+            manager = manager.db_manager(
+                router.db_for_write(manager.model))
+        return method(manager, *args, **kwargs)
+    return wrapper
+
 
 class AssociationManager(models.Manager):
+    @writes
+    @instrumented('define')
     def define(self, kind_, left, right):
-        if isinstance(kind_, str):
-            kind = AssociationKind.objects.get(name=kind_)
-        else:
-            kind = kind_
+        kind = AssociationKind.objects.db_manager(self.db).resolve(kind_)
 
-        left_type = ContentType.objects.get_for_model(left)
-        right_type = ContentType.objects.get_for_model(right)
+        # from the database written to, as the association's foreign
+        # keys must be
+        content_types = ContentType.objects.db_manager(self.db)
+        left_type = content_types.get_for_model(left)
+        right_type = content_types.get_for_model(right)
 
-        obj, created = Association.objects.get_or_create(
+        if not kind.closure and self._can_insert_returning():
+            return self._insert_or_get(kind, left_type, right_type,
+                                       left.id, right.id)
+
+        obj, created = self.get_or_create(
             kind=kind,
             left_type=left_type,
             right_type=right_type,
@@ -57,99 +269,1139 @@ class AssociationManager(models.Manager):
 
         return obj
 
-    def get_by_objects(self, kind, left, right):
+    def _can_insert_returning(self):
+        connection = connections[self.db]
+        return connection.vendor in ('postgresql', 'sqlite') and\
+            connection.features.can_return_rows_from_bulk_insert
+
+    def _insert_or_get(self, kind, left_type, right_type, left_id,
+                       right_id):
+        # One INSERT ... ON CONFLICT DO NOTHING RETURNING round trip for
+        # a new association; a conflict returns no row and the existing
+        # association is fetched. Types are checked against the cached
+        # kind by content type id, so save() is not needed.
+        check_types(kind, left_type.id, right_type.id)
+        obj = Association(kind=kind,
+                          left_type=left_type,
+                          right_type=right_type,
+                          left_id=left_id,
+                          right_id=right_id)
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        columns = ('kind_id', 'left_type_id', 'right_type_id',
+                   'left_id', 'right_id')
+        sql = 'INSERT INTO %s (%s) VALUES (%s) ' \
+              'ON CONFLICT DO NOTHING RETURNING %s' % (
+                  qn(Association._meta.db_table),
+                  ', '.join(qn(column) for column in columns),
+                  ', '.join(['%s'] * len(columns)),
+                  qn('id'))
+        # the maintenance of the derived tables commits, or fails,
+        # along with the row; without any there is nothing to wrap
+        if self._keeps_upkeep(kind):
+            atomic = transaction.atomic(using=self.db)
+        else:
+            atomic = contextlib.nullcontext()
+        with atomic:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [kind.id, left_type.id, right_type.id,
+                                     left_id, right_id])
+                row = cursor.fetchone()
+
+            if row is not None:
+                obj.id = row[0]
+                obj._state.adding = False
+                obj._state.db = self.db
+                # as Model.save() would for the maintenance hooks
+                post_save.send(sender=Association, instance=obj,
+                               created=True, update_fields=None, raw=False,
+                               using=self.db)
+                return obj
+
+        return self.get(kind=kind,
+                        left_type=left_type,
+                        right_type=right_type,
+                        left_id=left_id,
+                        right_id=right_id)
+
+    @writes
+    @instrumented('define')
+    def define_many(self, kind_, pairs, batch_size=1000):
+        '''
+        Defines associations of a single kind for many (left, right)
+        pairs. Types are checked once against the kind, duplicate pairs
+        are dropped and the rows are inserted in batches of batch_size.
+        Returns a tuple (created, existing) with the number of new
+        associations and of those that were already present.
+        '''
+        kind = AssociationKind.objects.db_manager(self.db).resolve(kind_)
+        return self._bulk_define(kind, self._id_pairs(kind, pairs),
+                                 batch_size)
+
+    def _id_pairs(self, kind, pairs):
+        # unique (left_id, right_id) of pairs, in order, after checking
+        # that each left and right is of the kind's models
+        left_class = kind.left_model
+        right_class = kind.right_model
+
+        seen = set()
+        id_pairs = []
+        for left, right in pairs:
+            if left.__class__ != left_class:
+                raise KeyError('left is wrong type (%s) should be (%s)' %
+                               (left.__class__._meta.label_lower,
+                                left_class._meta.label_lower))
+            if right.__class__ != right_class:
+                raise KeyError('right is wrong type (%s) should be (%s)' %
+                               (right.__class__._meta.label_lower,
+                                right_class._meta.label_lower))
+            pair = (left.id, right.id)
+            if pair not in seen:
+                seen.add(pair)
+                id_pairs.append(pair)
+        return id_pairs
+
+    async def adefine(self, kind_, left, right):
+        '''
+        Async version of define().
+        '''
+        return await sync_to_async(self.define)(kind_, left, right)
+
+    async def adefine_many(self, kind_, pairs, batch_size=1000):
+        '''
+        Async version of define_many().
+        '''
+        return await sync_to_async(self.define_many)(
+            kind_, list(pairs), batch_size)
+
+    def _bulk_define(self, kind, id_pairs, batch_size):
+        # id_pairs must be unique (left_id, right_id) tuples of the
+        # kind's types; each batch is inserted relying on the unique
+        # constraint to skip existing rows, and only the rows inserted
+        # are counted as created
+        created = 0
+        existing = 0
+        for start in range(0, len(id_pairs), batch_size):
+            batch = id_pairs[start:start + batch_size]
+            with transaction.atomic(using=self.db):
+                new = self._bulk_define_batch(kind, batch, batch_size)
+            created += len(new)
+            existing += len(batch) - len(new)
+
+        return created, existing
+
+    def _bulk_define_batch(self, kind, batch, batch_size):
+        if self._can_insert_returning():
+            new = self._insert_returning(kind, batch)
+        else:
+            # the pairs already present, looked up pair by pair; rows
+            # inserted concurrently after the lookup are skipped by
+            # the insert but counted as created
+            present = set()
+            for query in self._pair_queries(batch, batch_size):
+                present.update(self.filter(query, kind=kind).values_list(
+                    'left_id', 'right_id'))
+            new = [pair for pair in batch if pair not in present]
+            self.bulk_create([
+                Association(kind=kind,
+                            left_type_id=kind.left_type_id,
+                            right_type_id=kind.right_type_id,
+                            left_id=left_id,
+                            right_id=right_id)
+                for left_id, right_id in new],
+                batch_size=batch_size,
+                ignore_conflicts=True)
+        self._links_added(kind, new)
+        return new
+
+    def _insert_returning(self, kind, batch):
+        # INSERT ... ON CONFLICT DO NOTHING RETURNING of the pairs, as
+        # many rows per statement as the backend takes parameters;
+        # returns the pairs actually inserted
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        columns = ('kind_id', 'left_type_id', 'right_type_id',
+                   'left_id', 'right_id')
+        limit = connection.features.max_query_params
+        rows = max(1, limit // len(columns)) if limit else len(batch)
+        new = []
+        with connection.cursor() as cursor:
+            for start in range(0, len(batch), rows):
+                chunk = batch[start:start + rows]
+                sql = 'INSERT INTO %s (%s) VALUES %s ' \
+                      'ON CONFLICT DO NOTHING RETURNING %s, %s' % (
+                          qn(Association._meta.db_table),
+                          ', '.join(qn(column) for column in columns),
+                          ', '.join(['(%s)' % ', '.join(
+                              ['%s'] * len(columns))] * len(chunk)),
+                          qn('left_id'), qn('right_id'))
+                params = []
+                for left_id, right_id in chunk:
+                    params += [kind.id, kind.left_type_id,
+                               kind.right_type_id, left_id, right_id]
+                cursor.execute(sql, params)
+                new.extend(tuple(row) for row in cursor.fetchall())
+        return new
+
+    @writes
+    @instrumented('delete')
+    def undefine(self, kind_, left, right):
+        '''
+        Removes the association of kind between left and right, if any.
+        Returns the number of associations removed.
+        '''
+        kind = AssociationKind.objects.db_manager(self.db).resolve(kind_)
+        return self._bulk_undefine(
+            kind, self._id_pairs(kind, [(left, right)]), 1)
+
+    @writes
+    @instrumented('delete')
+    def undefine_many(self, kind_, pairs, batch_size=1000):
+        '''
+        Removes the associations of kind between many (left, right)
+        pairs with one DELETE per batch of batch_size pairs, bypassing
+        the per-row delete signals. Returns the number of associations
+        removed.
+        '''
+        kind = AssociationKind.objects.db_manager(self.db).resolve(kind_)
+        return self._bulk_undefine(kind, self._id_pairs(kind, pairs),
+                                   batch_size)
+
+    # widest OR of the queries of _pair_queries; SQLite parses a chain
+    # of ORs into a tree as deep as its terms and refuses it beyond a
+    # depth of 1000
+    pair_terms = 100
+
+    def _pair_queries(self, id_pairs, batch_size):
+        # Yields Q objects matching exactly id_pairs: the pairs grouped
+        # by left end into left_id = x AND right_id IN (...) terms, at
+        # most batch_size pairs and pair_terms terms per Q.
+        rights = {}
+        for left_id, right_id in id_pairs:
+            rights.setdefault(left_id, []).append(right_id)
+
+        query, terms, pairs = models.Q(), 0, 0
+        for left_id, right_ids in rights.items():
+            for start in range(0, len(right_ids), batch_size):
+                chunk = right_ids[start:start + batch_size]
+                if terms == self.pair_terms or \
+                        terms and pairs + len(chunk) > batch_size:
+                    yield query
+                    query, terms, pairs = models.Q(), 0, 0
+                query |= models.Q(left_id=left_id, right_id__in=chunk)
+                terms += 1
+                pairs += len(chunk)
+        if terms:
+            yield query
+
+    def _bulk_undefine(self, kind, id_pairs, batch_size):
+        removed = 0
+        for query in self._pair_queries(id_pairs, batch_size):
+            removed += self._delete_links(kind, self.filter(query, kind=kind))
+        return removed
+
+    @writes
+    @instrumented('delete')
+    def unlink_all(self, obj):
+        '''
+        Removes every association linking obj, on either side of any
+        kind, with one DELETE per kind and side. Returns the number of
+        associations removed.
+        '''
+        type_id = ContentType.objects.db_manager(self.db).get_for_model(
+            obj).id
+        removed = 0
+        # read from the database rather than the kind cache, which may
+        # miss kinds defined by another process
+        kinds = AssociationKind.objects.using(self.db).filter(
+            Q(left_type_id=type_id) | Q(right_type_id=type_id))
+        for kind in kinds:
+            for side in ('left', 'right'):
+                if getattr(kind, side + '_type_id') == type_id:
+                    removed += self._delete_links(kind, self.filter(
+                        kind=kind, **{side + '_id': obj.id}))
+        return removed
+
+    @writes
+    @instrumented('delete')
+    def delete_orphans(self, kind, side, chunk_size=10000, dry_run=False):
+        '''
+        Deletes the associations of kind whose item on side no longer
+        exists. The associations are scanned in chunks of chunk_size
+        ids, each checked against the item table with one anti-join,
+        so no long lock is held. Returns the number of orphans found.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        if side == 'left':
+            model = kind.left_model
+        elif side == 'right':
+            model = kind.right_model
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        items = model._default_manager.filter(pk=OuterRef(side + '_id'))
+
+        found = 0
+        last = 0
+        while True:
+            ids = list(self.filter(kind=kind, id__gt=last).order_by(
+                'id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return found
+            orphans = self.filter(
+                kind=kind, id__gt=last, id__lte=ids[-1]).exclude(
+                    Exists(items))
+            if dry_run:
+                found += orphans.count()
+            else:
+                found += self._delete_links(kind, orphans)
+            last = ids[-1]
+
+    def _delete_links(self, kind, qs):
+        # Deletes the associations of kind in qs with a single DELETE
+        # and runs the maintenance of the derived tables once for all.
+        routers.written()
+        if not self._keeps_upkeep(kind):
+            return qs._raw_delete(qs.db)
+        with transaction.atomic(using=self.db):
+            pairs = list(qs.values_list('left_id', 'right_id'))
+            if not pairs:
+                return 0
+            removed = qs._raw_delete(qs.db)
+            self._links_removed(kind, pairs)
+        return removed
+
+    def _keeps_upkeep(self, kind):
+        # whether changes to associations of kind need _links_added or
+        # _links_removed
+        return kind.closure or kind.counted or\
+            linked_cache.get_cache() is not None
+
+    def _links_added(self, kind, id_pairs):
+        # Maintains the tables and caches derived from the associations
+        # once associations of kind between id_pairs have been stored.
+        # Called from the post_save signal and by the bulk methods.
+        routers.written()
+        linked_cache.invalidate(kind, id_pairs, using=self.db)
+        if kind.closure:
+            AssociationClosure.objects.db_manager(self.db).add_links(
+                kind, id_pairs)
+        if kind.counted:
+            AssociationCount.objects.db_manager(self.db).add_links(
+                kind, id_pairs)
+
+    def _links_removed(self, kind, id_pairs):
+        # as _links_added, for removed associations
+        routers.written()
+        linked_cache.invalidate(kind, id_pairs, using=self.db)
+        if kind.closure:
+            AssociationClosure.objects.db_manager(self.db).remove_links(
+                kind, id_pairs)
+        if kind.counted:
+            AssociationCount.objects.db_manager(self.db).remove_links(
+                kind, id_pairs)
+
+    @instrumented('count')
+    def get_link_count(self, obj, kind, side='left', using=None):
+        '''
+        Returns the number of items linked to obj via kind, obj being on
+        side. Reads the AssociationCount table when the kind keeps
+        counts.
+        '''
+        using = using or self.db
+        kind = AssociationKind.objects.resolve(kind)
+        if side == 'left':
+            kind_class = kind.left_model
+        elif side == 'right':
+            kind_class = kind.right_model
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        if obj.__class__ != kind_class:
+            raise AttributeError(
+                "kind %s does not link to object %s" %
+                (kind.name, obj.__class__._meta.model_name))
+
+        if kind.counted:
+            counts = AssociationCount.objects.using(using).filter(
+                kind=kind, side=side, object_id=obj.id).values_list(
+                    'count', flat=True)
+            return next(iter(counts), 0)
+        return self.using(using).filter(
+            kind=kind, **{side + '_id': obj.id}).count()
+
+    @instrumented('get')
+    def get_by_objects(self, kind, left, right, using=None):
         left_type = ContentType.objects.get_for_model(left)
         right_type = ContentType.objects.get_for_model(right)
 
-        return Association.objects.get(
+        return self.using(using or self.db).get(
             kind=kind,
             left_type=left_type,
             right_type=right_type,
             left_id=left.id,
             right_id=right.id)
 
-    def get_linked(self, obj, kind, side):
-        if isinstance(kind, str):
-            kind = AssociationKind.objects.get(name=kind)
+    @instrumented('linked')
+    def get_linked(self, obj, kind, side, using=None):
+        kind = AssociationKind.objects.resolve(kind)
 
         if side == 'left':
-            kind_class = kind.left_type.model_class()
+            kind_class = kind.left_model
         else:
-            kind_class = kind.right_type.model_class()
+            kind_class = kind.right_model
         if obj.__class__ != kind_class:
             raise AttributeError(
                 "kind %s does not link to object %s" %
                 (kind.name, obj.__class__._meta.model_name))
 
+        cache = getattr(obj, '_associations_cache', {})
+        if (kind.id, side) in cache:
+            return cache[(kind.id, side)]
+
         if side is None or side == 'left':
-            id_list = Association.objects.filter(
-                kind=kind,
-                left_id=obj.id).values_list('right_id')
-            model = kind.right_type.model_class()
-            return model.objects.filter(id__in=id_list)
-        if side == 'right':
-            id_list = Association.objects.filter(
-                kind=kind,
-                right_id=obj.id).values_list('left_id')
-            model = kind.left_type.model_class()
-            return model.objects.filter(id__in=id_list)
-        raise AttributeError(
-            'side parameter must be "left" or "right"; not %s' %
-            (side, ))
-
-    def get_related(self, obj, kind, side='left'):
-        sql = 'SELECT DISTINCT m.id '\
-              'FROM %(table)s m, '\
-              'associations_association a, '\
-              'associations_association b '\
-              'WHERE b.kind_id=a.kind_id '\
-              'AND a.%(on_hand)s_id=%(id)d '\
-              'AND b.%(on_hand)s_id=m.id '\
-              'AND a.%(off_hand)s_id=b.%(off_hand)s_id '\
-              'AND b.%(on_hand)s_id != a.%(on_hand)s_id%(kind_sql)s'
-
-        dct = dict(id=obj.id)
-        if kind:
-            if isinstance(kind, str):
-                kind = AssociationKind.objects.get(name=kind)
-            if side == 'left':
-                kind_class = kind.left_type.model_class()
-            else:
-                kind_class = kind.right_type.model_class()
+            return self._linked(obj, kind, 'left', kind.right_model,
+                                'left_id', 'right_id', using)
+        elif side == 'right':
+            return self._linked(obj, kind, 'right', kind.left_model,
+                                'right_id', 'left_id', using)
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+
+    def _linked(self, obj, kind, side, model, on_hand, off_hand,
+                using=None, cached=True):
+        # query set of the items linked to obj once kind, side and the
+        # target model are known and checked; with the linked cache on
+        # (and cached) the ids are read from it, or on a miss from the
+        # database, right away
+        using = using or self.db
+        id_list = self.using(using).filter(
+            kind=kind,
+            **{on_hand: obj.id}).values_list(off_hand, flat=True)
+        if cached and linked_cache.get_cache() is not None:
+            id_list = linked_cache.get_ids(
+                kind, side, obj.id, lambda: id_list)
+        return model.objects.using(using).filter(id__in=id_list)
+
+    async def aget_linked(self, obj, kind, side='left', using=None):
+        '''
+        Async version of get_linked(); the kind is resolved without
+        blocking and the query set returned supports async iteration.
+        '''
+        kind = await AssociationKind.objects.aresolve(kind)
+        if linked_cache.get_cache() is None:
+            return self.get_linked(obj, kind, side, using)
+        # the linked cache is read, and filled on a miss, when the
+        # query set is built; do that off the event loop
+        return await sync_to_async(self.get_linked)(obj, kind, side, using)
+
+    @instrumented('linked')
+    def get_linked_many(self, objs, kind, side='left', using=None):
+        '''
+        Returns a dictionary mapping the pk of each of objs to a list of
+        the items linked to it; like calling get_linked for every
+        object but with one association query and one query on the
+        linked model.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        if side == 'left':
+            kind_class, model = kind.left_model, kind.right_model
+            on_hand, off_hand = 'left_id', 'right_id'
+        elif side == 'right':
+            kind_class, model = kind.right_model, kind.left_model
+            on_hand, off_hand = 'right_id', 'left_id'
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        for obj in objs:
             if obj.__class__ != kind_class:
                 raise AttributeError(
                     "kind %s does not link to object %s" %
                     (kind.name, obj.__class__._meta.model_name))
-            dct['kind_sql'] = ' and a.kind_id={}'.format(kind.id)
+
+        linked = dict((obj.id, []) for obj in objs)
+        if not linked:
+            return linked
+
+        using = using or self.db
+        sources = {}
+        pairs = self.using(using).filter(
+            kind=kind,
+            **{on_hand + '__in': list(linked)}).values_list(on_hand, off_hand)
+        for source_id, target_id in pairs:
+            sources.setdefault(target_id, []).append(source_id)
+
+        if sources:
+            # keep the ordering of the linked model as get_linked does
+            for item in model.objects.using(using).filter(
+                    id__in=list(sources)):
+                for source_id in sources[item.id]:
+                    linked[source_id].append(item)
+        return linked
+
+    @instrumented('linked')
+    def prefetch_linked(self, objs, kind, side='left', using=None):
+        '''
+        Fetches the linked items of all objs at once and caches them on
+        each object, so that obj.linked(kind, side) needs no query.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        linked = self.get_linked_many(objs, kind, side, using)
+        if side == 'left':
+            model, on_hand, off_hand = kind.right_model, 'left_id', 'right_id'
         else:
-            dct['kind_sql'] = ''
+            model, on_hand, off_hand = kind.left_model, 'right_id', 'left_id'
+        for obj in objs:
+            # the items are known; the linked cache would cost a query
+            # per object on a miss
+            qs = self._linked(obj, kind, side, model, on_hand, off_hand,
+                              using, cached=False)
+            qs._result_cache = linked[obj.id]
+            qs._prefetch_done = True
+            obj.__dict__.setdefault('_associations_cache', {})[
+                (kind.id, side)] = qs
 
+    def _linked_after(self, obj, kind, side, after, size, using):
+        # model and ids of the next size items linked to obj with ids
+        # above after, read in id order from the (kind, side, other
+        # side) index so each chunk costs the same whatever its offset
+        kind = AssociationKind.objects.resolve(kind)
+        if side == 'left':
+            kind_class, model = kind.left_model, kind.right_model
+            on_hand, off_hand = 'left_id', 'right_id'
+        elif side == 'right':
+            kind_class, model = kind.right_model, kind.left_model
+            on_hand, off_hand = 'right_id', 'left_id'
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        if obj.__class__ != kind_class:
+            raise AttributeError(
+                "kind %s does not link to object %s" %
+                (kind.name, obj.__class__._meta.model_name))
+
+        rows = self.using(using).filter(kind=kind, **{on_hand: obj.id})
+        if after is not None:
+            rows = rows.filter(**{off_hand + '__gt': after})
+        ids = list(rows.order_by(off_hand).values_list(
+            off_hand, flat=True)[:size])
+        return model, kind, ids
+
+    def _items(self, model, ids, using):
+        # items of ids in their order, skipping ids of deleted items
+        items = model.objects.using(using).in_bulk(ids)
+        return [items[id] for id in ids if id in items]
+
+    def iter_linked(self, obj, kind, side='left', chunk_size=1000,
+                    using=None):
+        '''
+        Yields the items linked to obj via kind in order of their ids,
+        reading chunk_size of them per query with keyset pagination.
+        Memory use does not depend on the number of linked items, and
+        later chunks cost no more than the first, unlike slicing the
+        query set of get_linked with OFFSET.
+        '''
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1; not %s' %
+                             (chunk_size, ))
+        using = using or self.db
+        after = None
+        while True:
+            model, kind, ids = self._linked_after(
+                obj, kind, side, after, chunk_size, using)
+            for item in self._items(model, ids, using):
+                yield item
+            if len(ids) < chunk_size:
+                return
+            after = ids[-1]
+
+    @instrumented('linked')
+    def get_linked_page(self, obj, kind, side='left', size=100,
+                        cursor=None, using=None):
+        '''
+        Returns a tuple (items, cursor) with a page of up to size items
+        linked to obj via kind in order of their ids, and an opaque
+        cursor token to pass back for the next page, None after the
+        last one. Tokens are signed and bound to obj, kind and side;
+        a token that is not raises ValueError.
+        '''
+        if size < 1:
+            raise ValueError('size must be at least 1; not %s' % (size, ))
+        resolved = AssociationKind.objects.resolve(kind)
+        salt = 'associations.linked_page'
+        bound = [resolved.id, side, obj.id]
+        after = None
+        if cursor is not None:
+            try:
+                value = signing.loads(cursor, salt=salt)
+            except signing.BadSignature:
+                raise ValueError('invalid cursor %r' % (cursor, ))
+            if not isinstance(value, list) or value[:-1] != bound:
+                raise ValueError('cursor %r is not for this listing' %
+                                 (cursor, ))
+            after = value[-1]
+
+        using = using or self.db
+        model, resolved, ids = self._linked_after(
+            obj, resolved, side, after, size + 1, using)
+        following = None
+        if len(ids) > size:
+            ids = ids[:size]
+            following = signing.dumps(bound + [ids[-1]], salt=salt,
+                                      compress=True)
+        return self._items(model, ids, using), following
+
+    def _related_rows(self, obj, kind, side):
+        # Returns (model, on_hand, scope, rows) where rows are the
+        # associations linking related items to the items shared with
+        # obj and scope filters the associations of the kinds used.
+        # With no kind every kind whose on-hand type is obj's model is
+        # used.
         if side is None or side == 'left':
-            model = kind.left_type.model_class()
-            dct['on_hand'] = 'left'
-            dct['off_hand'] = 'right'
+            on_hand, off_hand = 'left_id', 'right_id'
+            on_type = 'left_type'
         elif side == 'right':
-            model = kind.right_type.model_class()
-            dct['on_hand'] = 'right'
-            dct['off_hand'] = 'left'
+            on_hand, off_hand = 'right_id', 'left_id'
+            on_type = 'right_type'
         else:
             raise AttributeError(
                 "side must be 'left' or 'right' not {}".format(side))
 
-        dct['table'] = model._meta.db_table
-        return model.objects.raw(sql % dct)
+        if kind is None:
+            model = obj.__class__
+            on_type_id = ContentType.objects.get_for_model(model).id
+            kinds = [k for k in AssociationKind.objects.cached_kinds()
+                     if getattr(k, on_type + '_id') == on_type_id]
+            # per kind, the rows sharing an item with obj's own rows,
+            # each found from the (kind, other side) index
+            query = Q()
+            for k in kinds:
+                query |= Q(kind=k, **{off_hand + '__in': Subquery(
+                    Association.objects.filter(
+                        kind=k, **{on_hand: obj.id}).values(off_hand))})
+            scope = {'kind__in': kinds}
+            if kinds:
+                rows = Association.objects.filter(query)
+            else:
+                rows = Association.objects.none()
+        else:
+            kind = AssociationKind.objects.resolve(kind)
+            if on_type == 'left_type':
+                model = kind.left_model
+            else:
+                model = kind.right_model
+            if obj.__class__ != model:
+                raise AttributeError(
+                    "kind %s does not link to object %s" %
+                    (kind.name, obj.__class__._meta.model_name))
+            # items on the other side linked to obj
+            shared = Association.objects.filter(
+                kind=kind,
+                **{on_hand: obj.id}).values(off_hand)
+            # everything linked to any of those items
+            scope = {'kind': kind}
+            rows = Association.objects.filter(
+                kind=kind,
+                **{off_hand + '__in': shared})
+        return model, on_hand, scope, rows.exclude(**{on_hand: obj.id})
+
+    @instrumented('related')
+    def get_related(self, obj, kind=None, side='left', using=None):
+        '''
+        Returns a query set of the items related to obj: those on the
+        same side of an association of kind that share the item on the
+        other side. Without a kind, the items related via any kind
+        that has obj's model on that side are returned. The query set
+        is lazy, so it can be filtered, counted or sliced in the
+        database.
+        '''
+        model, on_hand, scope, rows = self._related_rows(obj, kind, side)
+        return model.objects.using(using or self.db).filter(
+            id__in=Subquery(rows.values(on_hand)))
+
+    async def aget_related(self, obj, kind=None, side='left',
+                           using=None):
+        '''
+        Async version of get_related(); the query set returned supports
+        async iteration.
+        '''
+        if kind is None:
+            # fills the content type and kind caches used by get_related
+            await sync_to_async(ContentType.objects.get_for_model)(
+                obj.__class__)
+            if AssociationKind.objects._fresh() is None:
+                await AssociationKind.objects._aload()
+        else:
+            kind = await AssociationKind.objects.aresolve(kind)
+        return self.get_related(obj, kind, side, using)
+
+    @instrumented('related')
+    def get_related_summary(self, obj, kind=None, side='left',
+                            using=None):
+        '''
+        Returns a dictionary mapping the pk of each item related to obj
+        to a dictionary with the number of items they share ('shared')
+        and the names of the kinds connecting them ('kinds'). Computed
+        with a single aggregate query.
+        '''
+        model, on_hand, scope, rows = self._related_rows(obj, kind, side)
+        summary = {}
+        counts = rows.using(using or self.db).order_by().values_list(
+            on_hand, 'kind').annotate(shared=Count('id'))
+        for pk, kind_id, shared in counts:
+            item = summary.setdefault(pk, dict(shared=0, kinds=[]))
+            item['shared'] += shared
+            item['kinds'].append(
+                AssociationKind.objects.resolve(kind_id).name)
+        for item in summary.values():
+            item['kinds'].sort()
+        return summary
+
+    @instrumented('related')
+    def get_related_ranked(self, obj, kind=None, side='left',
+                           normalize=None, limit=None, using=None):
+        '''
+        Returns the items related to obj ranked by strength. Each item
+        is annotated with the number of items it shares with obj
+        ('shared') and a 'score': the shared count itself, or, with
+        normalize set to 'jaccard' or 'cosine', the count normalized by
+        the degrees of both items. The query set is ordered by
+        decreasing score and cut to the top limit items; counting,
+        ordering and limiting all run in the database.
+        '''
+        model, on_hand, scope, rows = self._related_rows(obj, kind, side)
+
+        def count(qs):
+            return Subquery(qs.order_by().values(on_hand).annotate(
+                n=Count('id')).values('n'))
+
+        shared = count(rows.filter(**{on_hand: OuterRef('pk')}))
+        qs = model.objects.using(using or self.db).filter(
+            id__in=Subquery(rows.values(on_hand))).annotate(shared=shared)
+
+        if normalize is None:
+            qs = qs.annotate(score=F('shared'))
+        else:
+            degree = Cast(count(Association.objects.filter(
+                **scope, **{on_hand: obj.id})), FloatField())
+            other = Cast(count(Association.objects.filter(
+                **scope, **{on_hand: OuterRef('pk')})), FloatField())
+            if normalize == 'jaccard':
+                score = Cast('shared', FloatField()) / (
+                    degree + other - F('shared'))
+            elif normalize == 'cosine':
+                score = Cast('shared', FloatField()) / Sqrt(degree * other)
+            else:
+                raise ValueError(
+                    "normalize must be None, 'jaccard' or 'cosine' "
+                    "not {}".format(normalize))
+            qs = qs.annotate(score=score)
+
+        qs = qs.order_by('-score', '-shared', 'pk')
+        if limit is not None:
+            qs = qs[:limit]
+        return qs
+
+    def _closure_kind(self, obj, kind):
+        kind = AssociationKind.objects.resolve(kind)
+        if obj.__class__ != kind.left_model or\
+           kind.left_type_id != kind.right_type_id:
+            raise AttributeError(
+                "kind %s does not link object %s to itself" %
+                (kind.name, obj.__class__._meta.model_name))
+        return kind
+
+    @instrumented('traverse')
+    def get_descendants(self, obj, kind, using=None):
+        '''
+        Returns a query set of the items reached from obj following
+        kind left to right any number of times. Uses the closure table
+        when the kind keeps one, and traverse otherwise.
+        '''
+        kind = self._closure_kind(obj, kind)
+        if not kind.closure:
+            return self.traverse(obj, [(kind, 'left')], using=using)
+        ids = AssociationClosure.objects.filter(
+            kind=kind, ancestor_id=obj.id).values('descendant_id')
+        return kind.right_model.objects.using(using or self.db).filter(
+            id__in=ids)
+
+    @instrumented('traverse')
+    def get_ancestors(self, obj, kind, using=None):
+        '''
+        Returns a query set of the items from which obj is reached
+        following kind left to right any number of times.
+        '''
+        kind = self._closure_kind(obj, kind)
+        if not kind.closure:
+            return self.traverse(obj, [(kind, 'right')], using=using)
+        ids = AssociationClosure.objects.filter(
+            kind=kind, descendant_id=obj.id).values('ancestor_id')
+        return kind.left_model.objects.using(using or self.db).filter(
+            id__in=ids)
+
+    @instrumented('traverse')
+    def is_ancestor(self, ancestor, descendant, kind, using=None):
+        '''
+        Returns True if descendant is reached from ancestor following
+        kind left to right any number of times.
+        '''
+        kind = self._closure_kind(ancestor, kind)
+        if not kind.closure:
+            return self.get_descendants(ancestor, kind, using).filter(
+                id=descendant.id).exists()
+        return AssociationClosure.objects.using(using or self.db).filter(
+            kind=kind,
+            ancestor_id=ancestor.id,
+            descendant_id=descendant.id).exists()
+
+    @instrumented('traverse')
+    def traverse(self, obj, steps, max_depth=None, limit=None,
+                 using=None):
+        '''
+        Returns a query set of the items reached from obj by following
+        steps, a list of (kind, side) pairs where side is the side the
+        current items are on, as in get_linked. A chain of several
+        steps follows each one once. A single step of a kind that links
+        a model to itself is followed repeatedly, up to max_depth times
+        or until no new items are found; cycles are cut and obj itself
+        is not returned. Either way the whole traversal is one SQL
+        statement. limit cuts the result to its first items.
+        '''
+        using = using or self.db
+        hops = []
+        model = obj.__class__
+        for kind, side in steps:
+            kind = AssociationKind.objects.resolve(kind)
+            if side == 'left':
+                on_model, off_model = kind.left_model, kind.right_model
+                on_hand, off_hand = 'left_id', 'right_id'
+            elif side == 'right':
+                on_model, off_model = kind.right_model, kind.left_model
+                on_hand, off_hand = 'right_id', 'left_id'
+            else:
+                raise AttributeError(
+                    'side parameter must be "left" or "right"; not %s' %
+                    (side, ))
+            if model != on_model:
+                raise AttributeError(
+                    "kind %s does not link to object %s" %
+                    (kind.name, model._meta.model_name))
+            hops.append((kind, on_hand, off_hand))
+            model = off_model
+        if not hops:
+            raise ValueError('traverse needs at least one step')
+
+        if len(hops) == 1 and model == obj.__class__:
+            kind, on_hand, off_hand = hops[0]
+            ids = self._walk_sql(obj, kind, on_hand, off_hand, max_depth,
+                                 using)
+        elif max_depth is not None and max_depth < len(hops):
+            raise ValueError('max_depth is shorter than the chain of steps')
+        else:
+            ids = [obj.id]
+            for kind, on_hand, off_hand in hops:
+                ids = Association.objects.filter(
+                    kind=kind,
+                    **{on_hand + '__in': ids}).values(off_hand)
+
+        qs = model.objects.using(using).filter(id__in=ids)
+        if limit is not None:
+            qs = qs[:limit]
+        return qs
+
+    def _walk_sql(self, obj, kind, on_hand, off_hand, max_depth, using):
+        # Recursive CTE walking kind from obj. Without a depth the
+        # UNION drops nodes already visited, which also stops cycles;
+        # with one, nodes are kept per depth up to max_depth.
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        dct = dict(table=qn(Association._meta.db_table),
+                   on_hand=qn(on_hand), off_hand=qn(off_hand),
+                   kind_id=qn('kind_id'))
+        if max_depth is None:
+            sql = 'WITH RECURSIVE walk(node) AS ('\
+                  'SELECT a.%(off_hand)s FROM %(table)s a '\
+                  'WHERE a.%(kind_id)s = %%s AND a.%(on_hand)s = %%s '\
+                  'UNION '\
+                  'SELECT a.%(off_hand)s FROM %(table)s a, walk w '\
+                  'WHERE a.%(kind_id)s = %%s AND a.%(on_hand)s = w.node) '\
+                  'SELECT node FROM walk WHERE node != %%s'
+            params = [kind.id, obj.id, kind.id, obj.id]
+        else:
+            sql = 'WITH RECURSIVE walk(node, depth) AS ('\
+                  'SELECT a.%(off_hand)s, 1 FROM %(table)s a '\
+                  'WHERE a.%(kind_id)s = %%s AND a.%(on_hand)s = %%s '\
+                  'UNION '\
+                  'SELECT a.%(off_hand)s, w.depth + 1 '\
+                  'FROM %(table)s a, walk w '\
+                  'WHERE a.%(kind_id)s = %%s AND a.%(on_hand)s = w.node '\
+                  'AND w.depth < %%s) '\
+                  'SELECT node FROM walk WHERE node != %%s'
+            params = [kind.id, obj.id, kind.id, max_depth, obj.id]
+        return RawSQL(sql % dct, params)
+
+    @instrumented('linked')
+    def having(self, *predicates, using=None):
+        '''
+        Returns a lazy query set of the items satisfying all of
+        predicates. A predicate is a Linked, or a (kind, side, endpoint)
+        tuple, and predicates combine with &, | and ~ into one SQL
+        statement. An intersection of endpoints of one kind and side,
+        as in having((kind, side, bob), (kind, side, ann)), is counted
+        with GROUP BY ... HAVING COUNT; anything else uses EXISTS.
+        '''
+        if not predicates:
+            raise ValueError('having needs at least one predicate')
+        predicate = Linked.coerce(predicates[0])
+        for other in predicates[1:]:
+            predicate = predicate & other
+
+        leaves = predicate._conjunction()
+        if leaves and len(leaves) > 1 and None not in (
+                leaf.endpoint for leaf in leaves):
+            grouped = self._having_count(leaves, using or self.db)
+            if grouped is not None:
+                return grouped
+
+        model, q = predicate.compile()
+        return model.objects.using(using or self.db).filter(q)
+
+    def _having_count(self, leaves, using):
+        # items linked to every endpoint of leaves, which share a kind
+        # and side, counted per item in one GROUP BY
+        kinds = set(AssociationKind.objects.resolve(leaf.kind).id
+                    for leaf in leaves)
+        if len(kinds) > 1 or len(set(leaf.side for leaf in leaves)) > 1:
+            return None
+        model, kind, on_hand, off_hand = leaves[0]._resolve()
+        for leaf in leaves[1:]:
+            leaf._resolve()
+        ids = set(leaf.endpoint.id for leaf in leaves)
+        rows = Association.objects.filter(
+            kind=kind,
+            **{on_hand + '__in': ids}).order_by().values(
+                off_hand).annotate(
+                    n=Count(on_hand, distinct=True)).filter(
+                        n=len(ids)).values(off_hand)
+        return model.objects.using(using).filter(id__in=rows)
+
+
+class AssociatedQuerySet(models.QuerySet):
+    '''
+    Query set for models registered with associations; use
+    AssociatedQuerySet.as_manager() as the model manager to prefetch
+    linked items.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(AssociatedQuerySet, self).__init__(*args, **kwargs)
+        self._association_lookups = []
+        self._associations_done = False
+
+    def prefetch_associations(self, *kinds, side='left'):
+        '''
+        Returns a new query set that, when evaluated, fetches the items
+        linked to its instances via each of kinds in one batch per kind.
+        A kind may also be given as a (kind, side) tuple.
+        '''
+        clone = self._chain()
+        for kind in kinds:
+            if isinstance(kind, tuple):
+                clone._association_lookups.append(kind)
+            else:
+                clone._association_lookups.append((kind, side))
+        return clone
+
+    def annotate_link_count(self, kind, side='left', name=None):
+        '''
+        Annotates each instance with the number of items linked to it
+        via kind, the instance being on side; the annotation is named
+        name or <kind>_count.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        if side not in ('left', 'right'):
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        if name is None:
+            name = '%s_count' % kind.name
+
+        if kind.counted:
+            count = AssociationCount.objects.filter(
+                kind=kind, side=side,
+                object_id=OuterRef('pk')).values('count')
+        else:
+            count = Association.objects.filter(
+                kind=kind,
+                **{side + '_id': OuterRef('pk')}).order_by().values(
+                    side + '_id').annotate(n=Count('id')).values('n')
+        return self.annotate(**{name: Coalesce(Subquery(count), 0)})
+
+    def _clone(self):
+        clone = super(AssociatedQuerySet, self)._clone()
+        clone._association_lookups = self._association_lookups[:]
+        return clone
+
+    def _fetch_all(self):
+        super(AssociatedQuerySet, self)._fetch_all()
+        if self._association_lookups and not self._associations_done:
+            objs = [obj for obj in self._result_cache
+                    if isinstance(obj, models.Model)]
+            for kind, side in self._association_lookups:
+                Association.objects.prefetch_linked(objs, kind, side)
+            self._associations_done = True
+
+
+class Linked(object):
+    '''
+    A predicate over the items linked via kind to endpoint, endpoint
+    being on side; the items are on the other side. An endpoint of
+    None matches items linked to anything via kind. Predicates
+    combine with & (and), | (or) and ~ (not); see
+    AssociationManager.having.
+    '''
+    AND = 'AND'
+    OR = 'OR'
+
+    def __init__(self, kind, side, endpoint=None):
+        self.kind = kind
+        self.side = side
+        self.endpoint = endpoint
+        self.connector = None
+        self.children = []
+        self.negated = False
+
+    @classmethod
+    def coerce(cls, predicate):
+        if isinstance(predicate, Linked):
+            return predicate
+        if isinstance(predicate, tuple):
+            return cls(*predicate)
+        raise ValueError('predicate must be Linked or a (kind, side, '
+                         'endpoint) tuple; not %r' % (predicate, ))
+
+    def _combine(self, other, connector):
+        node = Linked(None, None)
+        node.connector = connector
+        node.children = [self, Linked.coerce(other)]
+        return node
+
+    def __and__(self, other):
+        return self._combine(other, Linked.AND)
+
+    def __rand__(self, other):
+        return Linked.coerce(other)._combine(self, Linked.AND)
+
+    def __or__(self, other):
+        return self._combine(other, Linked.OR)
+
+    def __ror__(self, other):
+        return Linked.coerce(other)._combine(self, Linked.OR)
+
+    def __invert__(self):
+        node = Linked(self.kind, self.side, self.endpoint)
+        node.connector = self.connector
+        node.children = self.children
+        node.negated = not self.negated
+        return node
+
+    def __repr__(self):
+        if self.connector:
+            text = '(%s)' % (' %s ' % self.connector).join(
+                repr(child) for child in self.children)
+        else:
+            text = 'Linked(%r, %r, %r)' % (self.kind, self.side,
+                                           self.endpoint)
+        return '~' + text if self.negated else text
+
+    def _conjunction(self):
+        # the leaves of a tree of ands, or None if it has ors or nots
+        if self.negated:
+            return None
+        if self.connector is None:
+            return [self]
+        if self.connector != Linked.AND:
+            return None
+        leaves = []
+        for child in self.children:
+            child_leaves = child._conjunction()
+            if child_leaves is None:
+                return None
+            leaves.extend(child_leaves)
+        return leaves
+
+    def _resolve(self):
+        # (target model, kind, on_hand, off_hand) of a leaf
+        kind = AssociationKind.objects.resolve(self.kind)
+        if self.side == 'left':
+            on_model, model = kind.left_model, kind.right_model
+            on_hand, off_hand = 'left_id', 'right_id'
+        elif self.side == 'right':
+            on_model, model = kind.right_model, kind.left_model
+            on_hand, off_hand = 'right_id', 'left_id'
+        else:
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (self.side, ))
+        if self.endpoint is not None and \
+                self.endpoint.__class__ != on_model:
+            raise AttributeError(
+                "kind %s does not link to object %s" %
+                (kind.name, self.endpoint.__class__._meta.model_name))
+        return model, kind, on_hand, off_hand
+
+    def compile(self):
+        '''
+        Returns (model, q): the model of the items matched and a Q
+        object selecting them with EXISTS subqueries.
+        '''
+        if self.connector is None:
+            model, kind, on_hand, off_hand = self._resolve()
+            lookups = {off_hand: OuterRef('pk')}
+            if self.endpoint is not None:
+                lookups[on_hand] = self.endpoint.id
+            q = Q(Exists(Association.objects.filter(kind=kind, **lookups)))
+        else:
+            model = None
+            q = None
+            for child in self.children:
+                child_model, child_q = child.compile()
+                if model is not None and child_model != model:
+                    raise KeyError(
+                        'predicates match different types (%s) and (%s)' %
+                        (model._meta.label_lower,
+                         child_model._meta.label_lower))
+                model = child_model
+                if q is None:
+                    q = child_q
+                elif self.connector == Linked.AND:
+                    q = q & child_q
+                else:
+                    q = q | child_q
+        return model, ~q if self.negated else q
 
 
 class Association(models.Model):
-    kind = models.ForeignKey(AssociationKind, models.CASCADE)
+    # indexed as the first column of the composite indexes
+    kind = models.ForeignKey(AssociationKind, models.CASCADE,
+                             db_index=False)
 
+    # determined by kind; kept for the generic foreign keys and not
+    # part of any index
     left_type = models.ForeignKey(ContentType, models.CASCADE,
-                                  related_name='left')
+                                  related_name='left', db_index=False)
     right_type = models.ForeignKey(ContentType, models.CASCADE,
-                                   related_name='right')
+                                   related_name='right', db_index=False)
 
-    left_id = models.PositiveIntegerField(db_index=True)
-    right_id = models.PositiveIntegerField(db_index=True)
+    left_id = models.PositiveBigIntegerField()
+    right_id = models.PositiveBigIntegerField()
 
     left = GenericForeignKey('left_type', 'left_id')
     right = GenericForeignKey('right_type', 'right_id')
@@ -157,8 +1409,17 @@ class Association(models.Model):
     objects = AssociationManager()
 
     class Meta:
-        unique_together = (('kind', 'left_type', 'right_type',
-                            'left_id', 'right_id', ), )
+        # the types follow from the kind, so (kind, left_id, right_id)
+        # is unique; with its reverse it covers the linked and related
+        # lookups from either side
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'left_id', 'right_id'],
+                                    name='assoc_kind_left_right_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'right_id', 'left_id'],
+                         name='assoc_kind_right_left_idx'),
+        ]
 
     def __str__(self):
         return "%s[%s(%s),%s(%s)]" % (
@@ -166,19 +1427,258 @@ class Association(models.Model):
             self.right, self.right_type)
 
     def save(self, *args, **kwargs):
-        if self.left_type.app_label != self.kind.left_type.app_label or\
-           self.left_type.model != self.kind.left_type.model:
-            raise KeyError('left is wrong type (%s:%s) should be (%s:%s)' %
-                           (self.left_type.app_label, self.left_type.model,
-                            self.kind.left_type.app_label,
-                            self.kind.left_type.model,))
-        if self.right_type.app_label != self.kind.right_type.app_label or\
-           self.right_type.model != self.kind.right_type.model:
-            raise KeyError('right is wrong type (%s:%s) should be (%s:%s)' %
-                           (self.right_type.app_label, self.right_type.model,
-                            self.kind.right_type.app_label,
-                            self.kind.right_type.model,))
-        super(Association, self).save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(
+            Association, instance=self)
+        kind = AssociationKind.objects.db_manager(using).resolve(
+            self.kind_id)
+        check_types(kind, self.left_type_id, self.right_type_id)
+        if kind.closure or kind.counted or not self._state.adding:
+            # the maintenance run from post_save, which may refuse the
+            # link, and for an update that of the link replaced, commit
+            # along with the row
+            with transaction.atomic(using=using):
+                super(Association, self).save(*args, **kwargs)
+        else:
+            super(Association, self).save(*args, **kwargs)
+
+
+def check_types(kind, left_type_id, right_type_id):
+    '''
+    Raises KeyError unless the content types of left and right are
+    those of kind. Compares ids only; the content types are looked up
+    (in the content type cache) just for the error message.
+    '''
+    for side, type_id, kind_type_id in (
+            ('left', left_type_id, kind.left_type_id),
+            ('right', right_type_id, kind.right_type_id)):
+        if type_id != kind_type_id:
+            actual = ContentType.objects.get_for_id(type_id)
+            expected = ContentType.objects.get_for_id(kind_type_id)
+            raise KeyError('%s is wrong type (%s:%s) should be (%s:%s)' %
+                           (side, actual.app_label, actual.model,
+                            expected.app_label, expected.model,))
+
+
+class AssociationCountManager(models.Manager):
+    def _change(self, kind, id_pairs, sign):
+        for side, index in (('left', 0), ('right', 1)):
+            # object ids grouped by how much their count changes
+            changes = {}
+            for pair in id_pairs:
+                changes[pair[index]] = changes.get(pair[index], 0) + 1
+            by_change = {}
+            for object_id, change in changes.items():
+                by_change.setdefault(change, []).append(object_id)
+
+            if sign > 0:
+                self.bulk_create([
+                    AssociationCount(kind=kind, side=side,
+                                     object_id=object_id, count=0)
+                    for object_id in changes], ignore_conflicts=True)
+            for change, object_ids in by_change.items():
+                self.filter(
+                    kind=kind, side=side, object_id__in=object_ids,
+                ).update(count=F('count') + sign * change)
+            if sign < 0:
+                self.filter(kind=kind, side=side, count__lte=0,
+                            object_id__in=list(changes)).delete()
+
+    def add_links(self, kind, id_pairs):
+        '''
+        Counts the new links (left_id, right_id) of kind.
+        '''
+        with transaction.atomic(using=self.db):
+            self._change(kind, id_pairs, 1)
+
+    def remove_links(self, kind, id_pairs):
+        '''
+        Discounts the removed links (left_id, right_id) of kind.
+        '''
+        with transaction.atomic(using=self.db):
+            self._change(kind, id_pairs, -1)
+
+    def recount(self, kind, batch_size=1000):
+        '''
+        Recomputes the counts of kind from its associations; returns
+        the number of count rows.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        total = 0
+        with transaction.atomic(using=self.db):
+            self.filter(kind=kind).delete()
+            for side in ('left', 'right'):
+                counts = Association.objects.filter(kind=kind).order_by(
+                    ).values_list(side + '_id').annotate(n=Count('id'))
+                rows = []
+                for object_id, count in counts.iterator():
+                    rows.append(AssociationCount(
+                        kind=kind, side=side, object_id=object_id,
+                        count=count))
+                    if len(rows) == batch_size:
+                        self.bulk_create(rows)
+                        total += len(rows)
+                        rows = []
+                self.bulk_create(rows)
+                total += len(rows)
+        return total
+
+
+class AssociationCount(models.Model):
+    '''
+    Number of associations of a kind with an item on one side.
+    '''
+    kind = models.ForeignKey(AssociationKind, models.CASCADE)
+
+    side = models.CharField(max_length=5,
+                            choices=(('left', 'left'), ('right', 'right')))
+    object_id = models.PositiveBigIntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = AssociationCountManager()
+
+    class Meta:
+        unique_together = (('kind', 'side', 'object_id', ), )
+
+    def __str__(self):
+        return "%s[%s %s]=%s" % (self.kind.name, self.side,
+                                 self.object_id, self.count)
+
+
+class AssociationClosureManager(models.Manager):
+    def _paths(self, kind, **kwargs):
+        return self.filter(kind=kind, **kwargs).values_list(
+            'ancestor_id' if 'descendant_id' in kwargs else 'descendant_id',
+            'depth', 'paths')
+
+    def _update(self, kind, left_id, right_id, sign):
+        # Every path from an ancestor of left (or left itself) to a
+        # descendant of right (or right itself) goes through the new
+        # link; their counts are added (or removed) per depth.
+        ups = [(left_id, 0, 1)] + list(
+            self._paths(kind, descendant_id=left_id))
+        downs = [(right_id, 0, 1)] + list(
+            self._paths(kind, ancestor_id=right_id))
+        if sign > 0 and (left_id == right_id or
+                         any(up == right_id for up, _, _ in ups)):
+            raise ValueError(
+                'link %s[%s,%s] would create a cycle' %
+                (kind.name, left_id, right_id))
+
+        delta = {}
+        for up, up_depth, up_paths in ups:
+            for down, down_depth, down_paths in downs:
+                key = (up, down, up_depth + down_depth + 1)
+                delta[key] = delta.get(key, 0) + up_paths * down_paths
+
+        rows = self.select_for_update().filter(
+            kind=kind,
+            ancestor_id__in=set(up for up, _, _ in ups),
+            descendant_id__in=set(down for down, _, _ in downs))
+        existing = dict(
+            ((row.ancestor_id, row.descendant_id, row.depth), row)
+            for row in rows)
+
+        changed = []
+        emptied = []
+        new = []
+        for key, paths in delta.items():
+            row = existing.get(key)
+            if row is not None:
+                row.paths += sign * paths
+                if row.paths > 0:
+                    changed.append(row)
+                else:
+                    emptied.append(row.id)
+            elif sign > 0:
+                new.append(AssociationClosure(
+                    kind=kind, ancestor_id=key[0], descendant_id=key[1],
+                    depth=key[2], paths=paths))
+        self.bulk_update(changed, ['paths'])
+        self.filter(id__in=emptied).delete()
+        self.bulk_create(new)
+
+    def add_links(self, kind, id_pairs):
+        '''
+        Adds the links (left_id, right_id) of kind to the closure;
+        raises ValueError if one would create a cycle.
+        '''
+        with transaction.atomic(using=self.db):
+            for left_id, right_id in id_pairs:
+                self._update(kind, left_id, right_id, 1)
+
+    def remove_links(self, kind, id_pairs):
+        '''
+        Removes the links (left_id, right_id) of kind from the closure.
+        '''
+        with transaction.atomic(using=self.db):
+            for left_id, right_id in id_pairs:
+                self._update(kind, left_id, right_id, -1)
+
+    def rebuild(self, kind, batch_size=1000):
+        '''
+        Recomputes the closure of kind from its associations; returns
+        the number of closure rows. Raises ValueError if the links of
+        kind have a cycle.
+        '''
+        kind = AssociationKind.objects.resolve(kind)
+        children = {}
+        links = Association.objects.filter(kind=kind).values_list(
+            'left_id', 'right_id')
+        for left_id, right_id in links.iterator():
+            children.setdefault(left_id, []).append(right_id)
+
+        rows = []
+        for ancestor in children:
+            paths = {ancestor: 1}
+            depth = 0
+            while paths:
+                depth += 1
+                if depth > len(children):
+                    raise ValueError('links of %s have a cycle through %s' %
+                                     (kind.name, ancestor))
+                reached = {}
+                for node, count in paths.items():
+                    for child in children.get(node, ()):
+                        reached[child] = reached.get(child, 0) + count
+                for descendant, count in reached.items():
+                    rows.append(AssociationClosure(
+                        kind=kind, ancestor_id=ancestor,
+                        descendant_id=descendant, depth=depth,
+                        paths=count))
+                paths = reached
+
+        with transaction.atomic(using=self.db):
+            self.filter(kind=kind).delete()
+            self.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+
+
+class AssociationClosure(models.Model):
+    '''
+    Transitive closure of a kind linking a model to itself: one row
+    per (ancestor, descendant, depth) holding the number of distinct
+    paths of that length between them.
+    '''
+    kind = models.ForeignKey(AssociationKind, models.CASCADE)
+
+    ancestor_id = models.PositiveBigIntegerField()
+    descendant_id = models.PositiveBigIntegerField()
+    depth = models.PositiveIntegerField()
+    paths = models.PositiveIntegerField(default=1)
+
+    objects = AssociationClosureManager()
+
+    class Meta:
+        unique_together = (('kind', 'ancestor_id', 'descendant_id',
+                            'depth', ), )
+        indexes = [
+            models.Index(fields=['kind', 'descendant_id', 'ancestor_id'],
+                         name='assoc_closure_desc_anc_idx'),
+        ]
+
+    def __str__(self):
+        return "%s[%s,%s,%s]" % (self.kind.name, self.ancestor_id,
+                                 self.descendant_id, self.depth)
 
 
 ######################
@@ -193,12 +1693,190 @@ def linked_to(self, kind, side='left'):
     return Association.objects.get_linked(self, kind, side)
 
 
+def iter_linked_to(self, kind, side='left', chunk_size=1000):
+    '''
+    Iterates over the items linked to this instance via kind in chunks
+    of chunk_size; for instances with very many linked items.
+    '''
+    return Association.objects.iter_linked(self, kind, side, chunk_size)
+
+
+def linked_page(self, kind, side='left', size=100, cursor=None):
+    '''
+    Returns a page of the items linked to this instance via kind and
+    the cursor of the next page; see AssociationManager.get_linked_page.
+    '''
+    return Association.objects.get_linked_page(self, kind, side, size,
+                                               cursor)
+
+
+async def alinked_to(self, kind, side='left'):
+    '''
+    Async version of linked_to; await it for a query set to iterate
+    with async for.
+    '''
+    return await Association.objects.aget_linked(self, kind, side)
+
+
+async def arelated_to(self, kind=None, side='left'):
+    '''
+    Async version of related_to.
+    '''
+    return await Association.objects.aget_related(self, kind, side)
+
+
+def link_count(self, kind, side='left'):
+    '''
+    Returns the number of items linked to this instance via the
+    association kind. Side specifies which side of the association
+    this instance is on.
+    '''
+    return Association.objects.get_link_count(self, kind, side)
+
+
 def related_to(self, kind=None, side='left'):
     '''
-    Returns a list of items (of the same model type as this instance)
+    Returns a query set of items (of the same model type as this instance)
     that are related to this instance. Related items have a pair (or more)
     of associations connecting the two items: ie, both are linked to the
     the same item. Suppose`Ann parentOF Flo' and 'Tim parentOf Flo' then Ann
     is related to Tim.
     '''
     return Association.objects.get_related(self, kind, side)
+
+
+######################
+# per kind descriptors; added when model is registered with kinds
+######################
+class LinkedDescriptor(object):
+    '''
+    Class attribute giving the items linked to an instance via one
+    kind from one side. The kind is resolved and checked against the
+    model on first access and bound until the kind cache is reloaded,
+    so later accesses skip the lookup by name and the type checks.
+    '''
+    def __init__(self, model, kind, side, name):
+        if side not in ('left', 'right'):
+            raise AttributeError(
+                'side parameter must be "left" or "right"; not %s' %
+                (side, ))
+        self.kind = kind
+        self.side = side
+        self.name = name
+        self.model = model
+        self._bound = None
+        self._entry = None
+
+    def bind(self):
+        '''
+        Returns (kind, target model, on_hand, off_hand).
+        '''
+        entry = AssociationKind.objects._fresh()
+        if entry is None or entry is not self._entry:
+            kind = AssociationKind.objects.resolve(self.kind)
+            if self.side == 'left':
+                on_model, model = kind.left_model, kind.right_model
+                on_hand, off_hand = 'left_id', 'right_id'
+            else:
+                on_model, model = kind.right_model, kind.left_model
+                on_hand, off_hand = 'right_id', 'left_id'
+            if on_model != self.model:
+                raise AttributeError(
+                    "kind %s does not link to object %s" %
+                    (kind.name, self.model._meta.model_name))
+            self._bound = (kind, model, on_hand, off_hand)
+            self._entry = AssociationKind.objects._fresh()
+        return self._bound
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return LinkedItems(self, instance)
+
+
+class LinkedItems(object):
+    '''
+    The items linked to an instance through a LinkedDescriptor. Works
+    like a related manager: all() and the query set methods give the
+    linked items, and prefetch_related() with the attribute name
+    fetches them for many instances at once.
+    '''
+    def __init__(self, descriptor, instance):
+        self.descriptor = descriptor
+        self.instance = instance
+
+    def _prefetched(self):
+        try:
+            return self.instance._prefetched_objects_cache[
+                self.descriptor.name]
+        except (AttributeError, KeyError):
+            return None
+
+    def get_queryset(self):
+        prefetched = self._prefetched()
+        if prefetched is not None:
+            return prefetched
+        kind, model, on_hand, off_hand = self.descriptor.bind()
+        return self._apply_rel_filters(
+            model.objects.using(Association.objects.db))
+
+    def all(self):
+        '''
+        Returns a query set of the linked items; prefetched items and
+        those of the linked cache are used when available.
+        '''
+        prefetched = self._prefetched()
+        if prefetched is not None:
+            return prefetched
+        kind, model, on_hand, off_hand = self.descriptor.bind()
+        side = self.descriptor.side
+        cache = getattr(self.instance, '_associations_cache', {})
+        if (kind.id, side) in cache:
+            return cache[(kind.id, side)]
+        return Association.objects._linked(self.instance, kind, side,
+                                           model, on_hand, off_hand)
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __getattr__(self, name):
+        # filter, count, exists, ... of the query set
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.all(), name)
+
+    def _apply_rel_filters(self, queryset):
+        kind, model, on_hand, off_hand = self.descriptor.bind()
+        return queryset.filter(id__in=Association.objects.filter(
+            kind=kind,
+            **{on_hand: self.instance.id}).values(off_hand))
+
+    def get_prefetch_querysets(self, instances, querysets=None):
+        # one query for the associations of all instances and one for
+        # the linked items; an item linked to several instances is
+        # copied so that each copy carries the instance it belongs to
+        kind, model, on_hand, off_hand = self.descriptor.bind()
+        using = Association.objects.db
+        queryset = querysets[0] if querysets else model.objects.using(using)
+
+        sources = {}
+        for source, target in Association.objects.using(using).filter(
+                kind=kind,
+                **{on_hand + '__in': [obj.id for obj in instances]}
+        ).values_list(on_hand, off_hand):
+            sources.setdefault(target, []).append(source)
+
+        linked = []
+        if sources:
+            for item in queryset.filter(id__in=list(sources)):
+                for number, source in enumerate(sources[item.id]):
+                    if number:
+                        item = copy.copy(item)
+                    item._linked_source = source
+                    linked.append(item)
+        return (linked,
+                lambda item: item._linked_source,
+                lambda obj: obj.id,
+                False,
+                self.descriptor.name,
+                False)
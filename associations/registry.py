@@ -1,7 +1,12 @@
 """
 Registery for associations. Inspired by Fantomas42/django-tagging
 """
-from .models import linked_to, related_to
+from django.db.models.signals import post_delete
+
+from .models import alinked_to, arelated_to, iter_linked_to
+from .models import link_count, linked_page, linked_to, related_to
+from .models import LinkedDescriptor
+from .signals import unlink_deleted
 
 registry = []
 
@@ -13,32 +18,67 @@ class AlreadyRegistered(Exception):
     pass
 
 
-def register(model, linked_attr='linked', related_attr='related'):
+def register(model, linked_attr='linked', related_attr='related',
+             link_count_attr='link_count', alinked_attr='alinked',
+             arelated_attr='arelated', iter_linked_attr='iter_linked',
+             linked_page_attr='linked_page', unlink_on_delete=True,
+             kinds=()):
     """
-    Sets the given model class up for working with association
+    Sets the given model class up for working with association. Unless
+    unlink_on_delete is False, deleting an instance removes all its
+    associations.
+
+    Each of kinds adds an attribute giving the items linked via one
+    kind: a (kind, side, attr) tuple, or the name of a kind to add as
+    an attribute of that name with the instances on the left side.
+    The attributes work like related managers and can be prefetched
+    with prefetch_related().
     """
     if model in registry:
         raise AlreadyRegistered(
             "The model '%s' has already been registered." %
             model._meta.object_name)
-    if hasattr(model, linked_attr):
-        raise AttributeError(
-            "'%s' already has an attribute '%s'. You must "
-            "provide a custom linked_attr to register." % (
-                model._meta.object_name,
-                linked_attr, ))
-    if hasattr(model, related_attr):
-        raise AttributeError(
-            "'%s' already has an attribute '%s'. You must "
-            "provide a custom related_attr to register." % (
-                model._meta.object_name,
-                related_attr, ))
-
-    # Add linked method
-    setattr(model, linked_attr, linked_to)
-
-    # Add related method
-    setattr(model, related_attr, related_to)
+    methods = (
+        ('linked_attr', linked_attr, linked_to),
+        ('related_attr', related_attr, related_to),
+        ('link_count_attr', link_count_attr, link_count),
+        ('alinked_attr', alinked_attr, alinked_to),
+        ('arelated_attr', arelated_attr, arelated_to),
+        ('iter_linked_attr', iter_linked_attr, iter_linked_to),
+        ('linked_page_attr', linked_page_attr, linked_page),
+    )
+    for param, attr, method in methods:
+        if hasattr(model, attr):
+            raise AttributeError(
+                "'%s' already has an attribute '%s'. You must "
+                "provide a custom %s to register." % (
+                    model._meta.object_name,
+                    attr, param, ))
+    descriptors = []
+    for spec in kinds:
+        if isinstance(spec, str):
+            spec = (spec, 'left', spec)
+        kind, side, attr = spec
+        if hasattr(model, attr):
+            raise AttributeError(
+                "'%s' already has an attribute '%s'. You must "
+                "provide another name for kind %s to register." % (
+                    model._meta.object_name, attr, kind, ))
+        descriptors.append(LinkedDescriptor(model, kind, side, attr))
+
+    # Add linked, related, link count methods, their async versions
+    # and the chunked and paged versions of linked
+    for param, attr, method in methods:
+        setattr(model, attr, method)
+    # Add the per kind attributes
+    for descriptor in descriptors:
+        setattr(model, descriptor.name, descriptor)
+
+    # Remove associations of deleted instances
+    if unlink_on_delete:
+        post_delete.connect(unlink_deleted, sender=model,
+                            dispatch_uid='associations_unlink_%s' %
+                            model._meta.label_lower)
 
     # Finally register in registry
     registry.append(model)
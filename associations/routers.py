@@ -0,0 +1,82 @@
+'''
+Database routing for associations on a primary with read replicas.
+
+Add the router to the DATABASE_ROUTERS setting:
+
+DATABASE_ROUTERS = ['associations.routers.AssociationRouter']
+
+Reads of the associations app then go to the ASSOCIATIONS_READ_DB
+alias and writes to ASSOCIATIONS_WRITE_DB ('default' by default). For
+ASSOCIATIONS_READ_YOUR_WRITES seconds (5 by default) after a thread or
+task writes associations, its own reads go to the primary as well, so
+that it sees its writes before the replica does.
+'''
+
+import contextvars
+import time
+
+from django.conf import settings
+
+# time until which reads of the current thread or task stay on the
+# primary
+_pinned_until = contextvars.ContextVar('associations_pinned_until',
+                                       default=0.0)
+
+
+def write_db():
+    '''
+    Returns the alias of the database associations are written to.
+    '''
+    return getattr(settings, 'ASSOCIATIONS_WRITE_DB', 'default')
+
+
+def read_db():
+    '''
+    Returns the alias of the database associations are read from: the
+    replica, unless there is none or the current thread or task wrote
+    recently.
+    '''
+    replica = getattr(settings, 'ASSOCIATIONS_READ_DB', None)
+    if replica is None or time.monotonic() < _pinned_until.get():
+        return write_db()
+    return replica
+
+
+def written():
+    '''
+    Keeps the reads of the current thread or task on the primary for
+    the read-your-writes window; called whenever associations change.
+    '''
+    window = getattr(settings, 'ASSOCIATIONS_READ_YOUR_WRITES', 5)
+    _pinned_until.set(time.monotonic() + window)
+
+
+def unpin():
+    '''
+    Ends the read-your-writes window of the current thread or task.
+    '''
+    _pinned_until.set(0.0)
+
+
+class AssociationRouter(object):
+    '''
+    Routes the models of the associations app; other models are left
+    to the next router.
+    '''
+    app_label = 'associations'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return read_db()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return write_db()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == self.app_label or \
+                obj2._meta.app_label == self.app_label:
+            return True
+        return None
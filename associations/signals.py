@@ -0,0 +1,67 @@
+'''
+Signal handlers for associations; connected when the app is ready
+'''
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import linked_cache
+from .models import Association
+from .models import AssociationKind
+
+
+@receiver(post_save, sender=AssociationKind)
+@receiver(post_delete, sender=AssociationKind)
+def clear_kind_cache(sender, using=None, **kwargs):
+    AssociationKind.objects.db_manager(using).kinds_changed()
+
+
+@receiver(pre_save, sender=Association)
+def association_saving(sender, instance, raw=False, using=None, **kwargs):
+    # an existing association may be moved to other items or another
+    # kind; remember what it linked so post_save can undo it
+    instance._saved_link = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._saved_link = Association.objects.using(using).filter(
+        pk=instance.pk).values_list(
+            'kind_id', 'left_id', 'right_id').first()
+
+
+@receiver(post_save, sender=Association)
+def association_saved(sender, instance, created, raw=False, using=None,
+                      **kwargs):
+    # fixtures are loaded raw; rebuild the derived tables afterwards
+    if raw:
+        return
+    kinds = AssociationKind.objects.db_manager(using)
+    manager = Association.objects.db_manager(using)
+    kind = kinds.resolve(instance.kind_id)
+    link = (instance.kind_id, instance.left_id, instance.right_id)
+    old = getattr(instance, '_saved_link', None)
+    instance._saved_link = None
+    if created:
+        manager._links_added(kind, [(instance.left_id, instance.right_id)])
+    elif old is not None and old != link:
+        manager._links_removed(kinds.resolve(old[0]), [old[1:]])
+        manager._links_added(kind, [(instance.left_id, instance.right_id)])
+    else:
+        linked_cache.invalidate(
+            kind, [(instance.left_id, instance.right_id)], using=using)
+
+
+@receiver(post_delete, sender=Association)
+def association_deleted(sender, instance, using=None, **kwargs):
+    try:
+        kind = AssociationKind.objects.db_manager(using).resolve(
+            instance.kind_id)
+    except AssociationKind.DoesNotExist:
+        # deleted along with its kind
+        return
+    Association.objects.db_manager(using)._links_removed(
+        kind, [(instance.left_id, instance.right_id)])
+
+
+def unlink_deleted(sender, instance, **kwargs):
+    # connected by registry.register() for each registered model
+    Association.objects.unlink_all(instance)
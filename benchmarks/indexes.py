@@ -0,0 +1,172 @@
+'''
+Benchmark of the composite (kind, left_id, right_id) and
+(kind, right_id, left_id) indexes on the association table.
+
+Run against a scratch database; the association table must be empty:
+
+DJANGO_SETTINGS_MODULE=test_settings python benchmarks/indexes.py \\
+    --rows 10000000
+
+The script migrates the associations app back to 0001 (no composite
+indexes), loads synthetic rows, prints the query plans and timings of
+the linked and related lookups, migrates forward to 0002 and repeats
+before migrating to the latest state.
+The last line of output is a JSON document with all the timings.
+'''
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.contenttypes.models import ContentType  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connections, transaction  # noqa: E402
+from django.db.migrations.loader import MigrationLoader  # noqa: E402
+
+from associations.models import Association  # noqa: E402
+from associations.models import AssociationKind  # noqa: E402
+from tests.models import Address, Person  # noqa: E402
+
+
+def define_kind(using, migration, name, left, right):
+    '''
+    Creates the kind name linking left to right while the associations
+    app is migrated to migration, through the historical model as the
+    kind table lacks the columns added later; returns it as an unsaved
+    AssociationKind good for filtering and for its ids.
+    '''
+    loader = MigrationLoader(connections[using])
+    migration = loader.get_migration_by_prefix('associations', migration)
+    state = loader.project_state((migration.app_label, migration.name))
+    historical = state.apps.get_model('associations', 'AssociationKind')
+    content_types = ContentType.objects.db_manager(using)
+    kind = historical.objects.using(using).create(
+        name=name,
+        left_type_id=content_types.get_for_model(left).id,
+        right_type_id=content_types.get_for_model(right).id)
+    return AssociationKind(id=kind.id, name=kind.name,
+                           left_type_id=kind.left_type_id,
+                           right_type_id=kind.right_type_id)
+
+
+def load(using, kind, rows, nodes, batch_size=50000):
+    '''
+    Inserts rows associations of kind between random pairs of nodes;
+    left ids follow a power law so that some nodes have many links.
+    '''
+    table = Association._meta.db_table
+    sql = 'INSERT INTO %s (kind_id, left_type_id, right_type_id, '\
+          'left_id, right_id) VALUES (%%s, %%s, %%s, %%s, %%s)' % table
+    seen = set()
+    with connections[using].cursor() as cursor:
+        while len(seen) < rows:
+            batch = []
+            while len(batch) < batch_size and len(seen) < rows:
+                pair = (int(random.paretovariate(1.2)) % nodes + 1,
+                        random.randint(1, nodes))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                batch.append((kind.id, kind.left_type_id,
+                              kind.right_type_id) + pair)
+            with transaction.atomic(using=using):
+                cursor.executemany(sql, batch)
+    return sorted(set(left for left, right in seen))
+
+
+def queries(using, kind, node):
+    linked_left = Association.objects.using(using).filter(
+        kind=kind, left_id=node).values_list('right_id')
+    linked_right = Association.objects.using(using).filter(
+        kind=kind, right_id=node).values_list('left_id')
+    related = Association.objects.using(using).filter(
+        kind=kind,
+        right_id__in=Association.objects.using(using).filter(
+            kind=kind, left_id=node).values('right_id'),
+    ).exclude(left_id=node).values_list('left_id').distinct()
+    return dict(linked_left=linked_left,
+                linked_right=linked_right,
+                related=related)
+
+
+def measure(using, kind, sample, label):
+    print('== %s ==' % label)
+    for name, qs in queries(using, kind, sample[0]).items():
+        print('-- %s plan' % name)
+        print(qs.explain())
+
+    timings = {}
+    for node in sample:
+        for name, qs in queries(using, kind, node).items():
+            start = time.perf_counter()
+            list(qs)
+            timings.setdefault(name, []).append(
+                (time.perf_counter() - start) * 1000)
+
+    result = {}
+    for name, values in timings.items():
+        values.sort()
+        result[name] = dict(
+            mean_ms=statistics.mean(values),
+            p95_ms=values[int(len(values) * 0.95) - 1],
+            max_ms=values[-1])
+        print('-- %s: mean %.3fms p95 %.3fms max %.3fms' % (
+            name, result[name]['mean_ms'], result[name]['p95_ms'],
+            result[name]['max_ms']))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--nodes', type=int, default=None,
+                        help='distinct ids per side; default rows/10')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--database', default='default')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    using = args.database
+    call_command('migrate', database=using, verbosity=0)
+    if Association.objects.using(using).exists():
+        sys.exit('association table is not empty; use a scratch database')
+
+    call_command('migrate', 'associations', '0001', database=using,
+                 verbosity=0)
+    kind = define_kind(using, '0001', 'benchPersonOf', Person, Address)
+    nodes = args.nodes or max(args.rows // 10, 1)
+
+    start = time.perf_counter()
+    lefts = load(using, kind, args.rows, nodes)
+    print('loaded %d rows in %.1fs' % (args.rows,
+                                       time.perf_counter() - start))
+    sample = random.sample(lefts, min(args.samples, len(lefts)))
+
+    before = measure(using, kind, sample, 'before (0001)')
+    start = time.perf_counter()
+    call_command('migrate', 'associations', '0002', database=using,
+                 verbosity=0)
+    print('built indexes in %.1fs' % (time.perf_counter() - start))
+    after = measure(using, kind, sample, 'after (0002)')
+    call_command('migrate', database=using, verbosity=0)
+
+    print(json.dumps(dict(vendor=connections[using].vendor,
+                          rows=args.rows, nodes=nodes,
+                          samples=len(sample),
+                          before=before, after=after)))
+
+
+if __name__ == '__main__':
+    main()
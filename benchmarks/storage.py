@@ -0,0 +1,137 @@
+'''
+Benchmark of the compact storage layout of the association table:
+(kind, left_id, right_id) unique with big integer ids and no indexes
+on the type columns, against the layout of 0004.
+
+Run against a scratch database; the association table must be empty:
+
+DJANGO_SETTINGS_MODULE=test_settings python benchmarks/storage.py \\
+    --rows 1000000
+
+The script migrates the associations app back to 0004, loads synthetic
+rows, measures the size of the table and of each of its indexes and
+the timings of the linked and related lookups, migrates to 0006 and
+repeats. On PostgreSQL --partition then partitions the table by kind
+and measures it once more.
+The last line of output is a JSON document with all the results.
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_settings')
+
+from indexes import define_kind, load, measure  # noqa: E402
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connections  # noqa: E402
+
+from associations.models import Association  # noqa: E402
+from tests.models import Address, Person  # noqa: E402
+
+
+def sizes(using, rows):
+    '''
+    Returns the bytes used by the association table and by each of its
+    indexes, and the bytes per row.
+    '''
+    connection = connections[using]
+    table = Association._meta.db_table
+    indexes = {}
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # sums the partitions of a partitioned table
+            cursor.execute(
+                'SELECT SUM(pg_relation_size(relid)) '
+                'FROM pg_partition_tree(%s)', [table])
+            heap = cursor.fetchone()[0]
+            cursor.execute(
+                'SELECT i.indexrelid::regclass::text, '
+                'pg_relation_size(i.indexrelid) FROM pg_index i '
+                'JOIN pg_partition_tree(%s) t ON t.relid = i.indrelid',
+                [table])
+            for name, size in cursor.fetchall():
+                indexes[name] = size
+        elif connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = %s", [table])
+            names = [name for name, in cursor.fetchall()]
+            cursor.execute(
+                'SELECT name, SUM(pgsize) FROM dbstat '
+                'WHERE name IN (%s) GROUP BY name' %
+                ', '.join(['%s'] * (len(names) + 1)), [table] + names)
+            for name, size in cursor.fetchall():
+                indexes[name] = size
+            heap = indexes.pop(table)
+        else:
+            sys.exit('sizes of %s are not supported' % connection.vendor)
+    total = heap + sum(indexes.values())
+    print('-- table %d bytes, indexes %d bytes, %.1f bytes per row' % (
+        heap, total - heap, total / rows))
+    for name, size in sorted(indexes.items()):
+        print('   %s: %d bytes' % (name, size))
+    return dict(table_bytes=heap, index_bytes=indexes,
+                bytes_per_row=total / rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--nodes', type=int, default=None,
+                        help='distinct ids per side; default rows/10')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--database', default='default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partition', action='store_true',
+                        help='also measure the table partitioned by kind '
+                             '(PostgreSQL only)')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    using = args.database
+    call_command('migrate', database=using, verbosity=0)
+    if Association.objects.using(using).exists():
+        sys.exit('association table is not empty; use a scratch database')
+
+    call_command('migrate', 'associations', '0004', database=using,
+                 verbosity=0)
+    kind = define_kind(using, '0004', 'benchPersonOf', Person, Address)
+    nodes = args.nodes or max(args.rows // 10, 1)
+
+    start = time.perf_counter()
+    lefts = load(using, kind, args.rows, nodes)
+    print('loaded %d rows in %.1fs' % (args.rows,
+                                       time.perf_counter() - start))
+    sample = random.sample(lefts, min(args.samples, len(lefts)))
+
+    result = dict(vendor=connections[using].vendor, rows=args.rows,
+                  nodes=nodes, samples=len(sample))
+    result['before'] = dict(sizes(using, args.rows),
+                            **measure(using, kind, sample, 'before (0004)'))
+    start = time.perf_counter()
+    call_command('migrate', 'associations', '0006', database=using,
+                 verbosity=0)
+    print('migrated in %.1fs' % (time.perf_counter() - start))
+    result['after'] = dict(sizes(using, args.rows),
+                           **measure(using, kind, sample, 'after (0006)'))
+
+    if args.partition:
+        call_command('partition_associations', database=using,
+                     execute=True)
+        result['partitioned'] = dict(
+            sizes(using, args.rows),
+            **measure(using, kind, sample, 'partitioned'))
+    call_command('migrate', database=using, verbosity=0)
+
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ to create fixtures:
 rm db.sqlite3
 ./manage.py migrate
 ./manage.py shell < tests/create_fixtures.py
-./manage.py dumpdata --indent 2 tests associations > persons.json
+./manage.py dumpdata --natural-foreign --indent 2 tests associations > persons.json
 '''
 
 from tests.models import Person
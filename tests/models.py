@@ -1,10 +1,13 @@
 from django.db import models
+from associations.models import AssociatedQuerySet
 from associations.registry import register
 
 
 class Person(models.Model):
     name = models.CharField(max_length=16)
 
+    objects = AssociatedQuerySet.as_manager()
+
     class Meta:
         ordering = ('pk', )
 
@@ -15,6 +18,8 @@ class Person(models.Model):
 class Address(models.Model):
     street = models.CharField(max_length=32)
 
+    objects = AssociatedQuerySet.as_manager()
+
     class Meta:
         ordering = ('pk', )
 
@@ -22,5 +27,7 @@ class Address(models.Model):
         return self.street
 
 
-register(Person)
-register(Address)
+register(Person, kinds=[('parentOf', 'left', 'children'),
+                        ('parentOf', 'right', 'parents'),
+                        'livesAt'])
+register(Address, kinds=[('livesAt', 'right', 'residents')])
@@ -1,10 +1,12 @@
 from django.test import TestCase
+from django.test import override_settings
 
 from associations.models import Association
 from associations.models import AssociationKind
 from tests.models import Person
 from tests.models import Address
 from django.db import IntegrityError
+from django.db import transaction
 
 
 class KindTest(TestCase):
@@ -54,6 +56,69 @@ class KindTest(TestCase):
         kinds = AssociationKind.objects.all()
         self.assertEquals(2, len(kinds))
 
+    def test_resolve(self):
+        kind = AssociationKind.objects.resolve('livesAt')
+        with self.assertNumQueries(0):
+            self.assertEquals(kind, AssociationKind.objects.resolve(kind.id))
+            self.assertEquals(kind, AssociationKind.objects.resolve(kind))
+            self.assertEquals(Person, kind.left_model)
+            self.assertEquals(Address, kind.right_model)
+
+        with self.assertRaises(AssociationKind.DoesNotExist):
+            AssociationKind.objects.resolve('doesnotexist')
+
+    def test_resolve_invalidated(self):
+        kind = AssociationKind.objects.resolve('livesAt')
+        kind.description = 'where a person lives'
+        kind.save()
+        with self.assertNumQueries(1):
+            kind = AssociationKind.objects.resolve('livesAt')
+        self.assertEquals('where a person lives', kind.description)
+
+        new = AssociationKind.objects.define('newkind', Address, Address)
+        self.assertEquals(new, AssociationKind.objects.resolve('newkind'))
+        new.delete()
+        with self.assertRaises(AssociationKind.DoesNotExist):
+            AssociationKind.objects.resolve('newkind')
+
+    @override_settings(ASSOCIATIONS_KIND_CACHE_TTL=0)
+    def test_resolve_ttl(self):
+        AssociationKind.objects.resolve('livesAt')
+        with self.assertNumQueries(1):
+            AssociationKind.objects.resolve('livesAt')
+
+    def test_resolve_rollback(self):
+        class Rollback(Exception):
+            pass
+
+        with self.assertRaises(Rollback):
+            with transaction.atomic():
+                kind = AssociationKind.objects.get(name='parentOf')
+                kind.counted = True
+                kind.save()
+                AssociationKind.objects.define('ghost', Person, Person)
+                self.assertTrue(
+                    AssociationKind.objects.resolve('parentOf').counted)
+                with self.assertNumQueries(0):
+                    AssociationKind.objects.resolve('ghost')
+                raise Rollback
+        self.assertFalse(AssociationKind.objects.resolve('parentOf').counted)
+        with self.assertRaises(AssociationKind.DoesNotExist):
+            AssociationKind.objects.resolve('ghost')
+        with self.assertNumQueries(0):
+            AssociationKind.objects.resolve('parentOf')
+
+        # committed changes are cached again
+        with self.captureOnCommitCallbacks(execute=True):
+            kind = AssociationKind.objects.get(name='parentOf')
+            kind.description = 'a parent and a child'
+            kind.save()
+        with self.assertNumQueries(1):
+            kind = AssociationKind.objects.resolve('parentOf')
+        self.assertEquals('a parent and a child', kind.description)
+        with self.assertNumQueries(0):
+            AssociationKind.objects.resolve('parentOf')
+
 
 class AssociationTest(TestCase):
     fixtures = ['associations', 'tests', ]
@@ -78,6 +143,27 @@ class AssociationTest(TestCase):
         self.assertEquals(self.persons[0], assn.left)
         self.assertEquals(self.persons[0], assn.right)
 
+    def test_define_one_query(self):
+        joe, flo = self.persons[0], self.persons[5]
+        Association.objects.define('parentOf', joe, self.persons[1])
+        with self.assertNumQueries(1):
+            assn = Association.objects.define('parentOf', flo, joe)
+        self.assertEquals(assn, Association.objects.get_by_objects(
+            self.kinds['parentOf'], flo, joe))
+        # already defined; one more query to fetch it
+        with self.assertNumQueries(2):
+            assn1 = Association.objects.define('parentOf', flo, joe)
+        self.assertEquals(assn.id, assn1.id)
+
+    def test_define_bad(self):
+        with self.assertRaises(KeyError):
+            Association.objects.define(
+                'parentOf', self.addresses[0], self.persons[0])
+        with self.assertRaises(KeyError):
+            Association(kind=self.kinds['livesAt'],
+                        left=self.persons[0],
+                        right=self.persons[1]).save()
+
     def test_lookup(self):
         kind_name = 'parentOf'
         kind = self.kinds[kind_name]
@@ -145,6 +231,18 @@ class AssociationTest(TestCase):
         for n in range(len(items)):
             self.assertEquals(items[n].id, items1[n].id)
 
+    def test_linked_cached_kind(self):
+        AssociationKind.objects.resolve('parentOf')
+        person = self.persons[0]
+        # building the query set needs no kind lookups
+        with self.assertNumQueries(0):
+            items = Association.objects.get_linked(
+                person,
+                'parentOf',
+                'left')
+        with self.assertNumQueries(1):
+            self.assertEquals(2, len(items))
+
     def test_linked_address_right(self):
         kind = self.kinds['livesAt']
 
@@ -221,6 +319,77 @@ class AssociationTest(TestCase):
             self.assertEquals(items[n].id, items1[n].id)
             self.assertEquals(items[n].id, items2[n].id)
 
+    def test_related_queryset(self):
+        person = self.persons[0]
+        AssociationKind.objects.resolve('livesAt')
+        q = Association.objects.get_related(person, 'livesAt')
+        with self.assertNumQueries(1):
+            self.assertEquals(2, q.count())
+        self.assertEquals(['Bob', 'Sue'], [p.name for p in q])
+        self.assertEquals(['Sue'],
+                          [p.name for p in q.filter(name__startswith='S')])
+        self.assertEquals(['Bob'], [p.name for p in q[:1]])
+
+        # the instance itself is never related
+        self.assertFalse(q.filter(id=person.id).exists())
+
+    def test_related_any_kind(self):
+        joe, bob = self.persons[0], self.persons[1]
+        AssociationKind.objects.resolve('livesAt')
+        with self.assertNumQueries(1):
+            items = list(Association.objects.get_related(joe))
+        self.assertEquals(['Bob', 'Sue'], [p.name for p in items])
+
+        items = Association.objects.get_related(bob, side='right')
+        self.assertEquals(['Ann'], [p.name for p in items])
+
+        # addresses are only on the right of livesAt
+        self.assertEquals(
+            0, Association.objects.get_related(self.addresses[0]).count())
+        self.assertEquals(
+            0, Association.objects.get_related(
+                self.addresses[0], side='right').count())
+
+    def test_related_summary(self):
+        joe, sue, bob = self.persons[0], self.persons[2], self.persons[1]
+        AssociationKind.objects.resolve('livesAt')
+        with self.assertNumQueries(1):
+            summary = Association.objects.get_related_summary(joe)
+        self.assertEquals({
+            bob.id: dict(shared=1, kinds=['livesAt']),
+            sue.id: dict(shared=3, kinds=['livesAt', 'parentOf']),
+        }, summary)
+
+        summary = Association.objects.get_related_summary(joe, 'parentOf')
+        self.assertEquals({sue.id: dict(shared=2, kinds=['parentOf'])},
+                          summary)
+
+    def test_related_ranked(self):
+        joe = self.persons[0]
+        AssociationKind.objects.resolve('livesAt')
+        with self.assertNumQueries(1):
+            items = list(Association.objects.get_related_ranked(joe))
+        self.assertEquals([('Sue', 3), ('Bob', 1)],
+                          [(p.name, p.shared) for p in items])
+        self.assertEquals([3, 1], [p.score for p in items])
+
+        items = Association.objects.get_related_ranked(joe, limit=1)
+        self.assertEquals(['Sue'], [p.name for p in items])
+
+        items = Association.objects.get_related_ranked(
+            joe, normalize='jaccard')
+        self.assertEquals(['Sue', 'Bob'], [p.name for p in items])
+        self.assertAlmostEqual(1.0, items[0].score)
+        self.assertAlmostEqual(1 / 3.0, items[1].score)
+
+        items = Association.objects.get_related_ranked(
+            joe, 'parentOf', normalize='cosine')
+        self.assertEquals(['Sue'], [p.name for p in items])
+        self.assertAlmostEqual(1.0, items[0].score)
+
+        with self.assertRaises(ValueError):
+            Association.objects.get_related_ranked(joe, normalize='dice')
+
     def test_related_right(self):
         kind_name = 'parentOf'
 
@@ -238,3 +407,148 @@ class AssociationTest(TestCase):
             side='left')
         items = [item for item in q]
         self.assertEquals(0, len(items))
+
+    def test_define_many(self):
+        kind = self.kinds['parentOf']
+        before = Association.objects.filter(kind=kind).count()
+
+        # Joe parentOf Bob already exists; Bob parentOf Flo is repeated
+        pairs = [
+            (self.persons[0], self.persons[1]),
+            (self.persons[1], self.persons[5]),
+            (self.persons[1], self.persons[5]),
+            (self.persons[4], self.persons[3]),
+        ]
+        created, existing = Association.objects.define_many(
+            'parentOf', pairs, batch_size=2)
+        self.assertEquals(2, created)
+        self.assertEquals(1, existing)
+        self.assertEquals(before + 2,
+                          Association.objects.filter(kind=kind).count())
+
+        # again; nothing new
+        created, existing = Association.objects.define_many(kind, pairs)
+        self.assertEquals(0, created)
+        self.assertEquals(3, existing)
+
+    def test_define_many_without_returning(self):
+        manager = Association.objects.db_manager('default')
+        manager._can_insert_returning = lambda: False
+        joe, bob, sue, ann, jay, flo = self.persons
+        # Joe has other children than Flo and Jay; only the pairs asked
+        # for are looked up
+        with self.assertNumQueries(4):
+            created, existing = manager.define_many(
+                'parentOf', [(joe, flo), (joe, bob), (jay, flo)])
+        self.assertEquals((1, 2), (created, existing))
+        self.assertEquals(['Bob', 'Ann', 'Flo'],
+                          [p.name for p in joe.linked('parentOf')])
+
+    def test_define_many_bad(self):
+        with self.assertRaises(KeyError):
+            Association.objects.define_many(
+                'livesAt', [(self.persons[0], self.persons[1])])
+
+    def test_traverse(self):
+        joe, flo = self.persons[0], self.persons[5]
+
+        items = Association.objects.traverse(joe, [('parentOf', 'left')])
+        self.assertEquals(['Bob', 'Ann', 'Flo'], [p.name for p in items])
+
+        items = Association.objects.traverse(
+            joe, [('parentOf', 'left')], max_depth=1)
+        self.assertEquals(['Bob', 'Ann'], [p.name for p in items])
+
+        items = Association.objects.traverse(flo, [('parentOf', 'right')])
+        self.assertEquals(['Joe', 'Sue', 'Ann', 'Jay'],
+                          [p.name for p in items])
+
+        items = Association.objects.traverse(
+            flo, [('parentOf', 'right')], limit=2)
+        self.assertEquals(['Joe', 'Sue'], [p.name for p in items])
+
+    def test_traverse_chain(self):
+        joe = self.persons[0]
+
+        # where Joe's children live
+        steps = [('parentOf', 'left'), ('livesAt', 'left')]
+        with self.assertNumQueries(1):
+            items = list(Association.objects.traverse(joe, steps))
+        self.assertEquals(['123 Main', '213 Church'],
+                          [a.street for a in items])
+
+        # everyone living with one of Joe's children
+        steps.append(('livesAt', 'right'))
+        items = Association.objects.traverse(joe, steps)
+        self.assertEquals(6, items.count())
+
+        with self.assertRaises(AttributeError):
+            Association.objects.traverse(
+                joe, [('livesAt', 'left'), ('parentOf', 'left')])
+
+    def test_traverse_cycle(self):
+        joe, flo = self.persons[0], self.persons[5]
+        Association.objects.define('parentOf', flo, joe)
+
+        items = Association.objects.traverse(joe, [('parentOf', 'left')])
+        self.assertEquals(['Bob', 'Ann', 'Flo'], [p.name for p in items])
+
+        items = Association.objects.traverse(
+            joe, [('parentOf', 'left')], max_depth=10)
+        self.assertEquals(['Bob', 'Ann', 'Flo'], [p.name for p in items])
+
+    def test_undefine(self):
+        kind = self.kinds['parentOf']
+        joe, bob = self.persons[0], self.persons[1]
+        self.assertEquals(1, Association.objects.undefine(kind, joe, bob))
+        self.assertEquals(0, Association.objects.undefine(kind, joe, bob))
+        with self.assertRaises(Association.DoesNotExist):
+            Association.objects.get_by_objects(kind, joe, bob)
+        self.assertEquals(5, Association.objects.filter(kind=kind).count())
+
+    def test_undefine_wrong_type(self):
+        kind = self.kinds['parentOf']
+        main, bob = self.addresses[0], self.persons[1]
+        before = Association.objects.count()
+        # the address has the id of Joe, parent of Bob
+        self.assertEquals(self.persons[0].id, main.id)
+        with self.assertRaises(KeyError):
+            Association.objects.undefine(kind, main, bob)
+        with self.assertRaises(KeyError):
+            Association.objects.undefine_many(
+                'parentOf', [(self.persons[3], self.persons[5]),
+                             (main, bob)])
+        self.assertEquals(before, Association.objects.count())
+
+    def test_undefine_many(self):
+        kind = self.kinds['parentOf']
+        joe, bob, sue, ann = self.persons[:4]
+        # Joe parentOf Ann, Sue parentOf Bob stay
+        with self.assertNumQueries(1):
+            removed = Association.objects.undefine_many(
+                'parentOf', [(joe, bob), (sue, ann), (bob, joe)])
+        self.assertEquals(2, removed)
+        self.assertEquals(['Ann'], [p.name for p in joe.linked(kind)])
+        self.assertEquals(['Bob'], [p.name for p in sue.linked(kind)])
+
+    def test_undefine_many_wide(self):
+        joe = self.persons[0]
+        persons = Person.objects.bulk_create(
+            [Person(name='p%d' % i) for i in range(1050)])
+        pairs = [(person, joe) for person in persons]
+        Association.objects.define_many('parentOf', pairs)
+        # one DELETE per 100 left ends
+        with self.assertNumQueries(11):
+            removed = Association.objects.undefine_many('parentOf', pairs)
+        self.assertEquals(1050, removed)
+        self.assertEquals(0, joe.link_count('parentOf', side='right'))
+
+    def test_unlink_all(self):
+        ann = self.persons[3]
+        # parent of Flo, child of Joe and Sue, lives at Church
+        self.assertEquals(4, Association.objects.unlink_all(ann))
+        self.assertFalse(Association.objects.filter(
+            left_id=ann.id, left_type__model='person').exists())
+        self.assertFalse(Association.objects.filter(
+            right_id=ann.id, right_type__model='person').exists())
+        self.assertEquals(12 - 4, Association.objects.count())
@@ -0,0 +1,57 @@
+from django.test import TestCase
+
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Person
+
+
+class AsyncTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.persons = list(Person.objects.all())
+
+    def tearDown(self):
+        pass
+
+    async def test_alinked(self):
+        joe = self.persons[0]
+        items = await Association.objects.aget_linked(joe, 'parentOf')
+        self.assertEquals(['Bob', 'Ann'], [p.name async for p in items])
+
+        items = await joe.alinked('livesAt')
+        self.assertEquals(1, await items.acount())
+
+        with self.assertRaises(AssociationKind.DoesNotExist):
+            await joe.alinked('doesnotexist')
+
+    async def test_arelated(self):
+        joe = self.persons[0]
+        items = await Association.objects.aget_related(joe, 'livesAt')
+        self.assertEquals(['Bob', 'Sue'], [p.name async for p in items])
+
+        items = await joe.arelated()
+        self.assertEquals(['Bob', 'Sue'], [p.name async for p in items])
+
+    async def test_arelated_cold_cache(self):
+        AssociationKind.objects.clear_cache()
+        items = await self.persons[0].arelated()
+        self.assertEquals(['Bob', 'Sue'], [p.name async for p in items])
+
+    async def test_adefine(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        assn = await Association.objects.adefine('parentOf', flo, jay)
+        self.assertEquals(flo.id, assn.left_id)
+        created, existing = await Association.objects.adefine_many(
+            'parentOf', [(flo, jay), (bob, jay)])
+        self.assertEquals((1, 1), (created, existing))
+        items = await jay.alinked('parentOf', side='right')
+        self.assertEquals(['Bob', 'Flo'], [p.name async for p in items])
+
+    async def test_aresolve(self):
+        AssociationKind.objects.clear_cache()
+        kind = await AssociationKind.objects.aresolve('livesAt')
+        self.assertEquals('livesAt', kind.name)
+        self.assertEquals(Person, kind.left_model)
+        self.assertEquals(kind, await AssociationKind.objects.aresolve(
+            kind.id))
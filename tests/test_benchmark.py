@@ -0,0 +1,72 @@
+import io
+import json
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test import TransactionTestCase
+
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Person
+
+
+class BenchmarkTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.associations = Association.objects.count()
+
+    def tearDown(self):
+        pass
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_associations', '200', '500',
+                     samples=5, stdout=out, stderr=io.StringIO())
+        result = json.loads(out.getvalue())
+
+        self.assertEquals('tests.Person', result['model'])
+        self.assertEquals([200, 500],
+                          [run['edges'] for run in result['runs']])
+        run = result['runs'][0]
+        self.assertEquals(20, run['nodes'])
+        self.assertEquals(
+            ['define', 'linked_left', 'linked_right', 'related', 'save'],
+            sorted(run['operations']))
+        for name, stats in run['operations'].items():
+            self.assertEquals(5, stats['calls'])
+            self.assertTrue(stats['queries'] >= 1)
+
+        # everything created is removed
+        self.assertEquals(self.associations, Association.objects.count())
+        self.assertEquals(6, Person.objects.count())
+        self.assertFalse(AssociationKind.objects.filter(
+            name__startswith='benchmark').exists())
+
+    def test_dense(self):
+        # 50 associations at a fanout of 10 need more than 5 items
+        out = io.StringIO()
+        call_command('benchmark_associations', '50', samples=2,
+                     stdout=out, stderr=io.StringIO())
+        run = json.loads(out.getvalue())['runs'][0]
+        self.assertEquals(10, run['nodes'])
+        self.assertEquals(self.associations, Association.objects.count())
+
+
+class BenchmarkDatabaseTest(TransactionTestCase):
+    # the replica alias mirrors default, so the run is checked through
+    # default once the command is done
+    databases = {'default', 'replica'}
+    fixtures = ['tests', 'associations', ]
+
+    def test_database(self):
+        out = io.StringIO()
+        call_command('benchmark_associations', '100', samples=3,
+                     database='replica', stdout=out, stderr=io.StringIO())
+        result = json.loads(out.getvalue())
+        self.assertEquals('replica', result['database'])
+        run = result['runs'][0]
+        for name, stats in run['operations'].items():
+            self.assertEquals(3, stats['calls'])
+        self.assertEquals(12, Association.objects.count())
+        self.assertEquals(6, Person.objects.count())
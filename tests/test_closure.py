@@ -0,0 +1,121 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from associations.models import Association
+from associations.models import AssociationClosure
+from associations.models import AssociationKind
+from tests.models import Person
+
+
+class ClosureTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.kind = AssociationKind.objects.get(name='parentOf')
+        self.kind.closure = True
+        self.kind.save()
+        AssociationClosure.objects.rebuild(self.kind)
+        self.persons = Person.objects.all()
+
+    def tearDown(self):
+        pass
+
+    def rows(self):
+        return sorted(AssociationClosure.objects.filter(
+            kind=self.kind).values_list(
+                'ancestor_id', 'descendant_id', 'depth', 'paths'))
+
+    def test_rebuild(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        self.assertEquals(sorted([
+            (joe.id, bob.id, 1, 1), (joe.id, ann.id, 1, 1),
+            (sue.id, bob.id, 1, 1), (sue.id, ann.id, 1, 1),
+            (ann.id, flo.id, 1, 1), (jay.id, flo.id, 1, 1),
+            (joe.id, flo.id, 2, 1), (sue.id, flo.id, 2, 1),
+        ]), self.rows())
+
+    def test_descendants(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        with self.assertNumQueries(1):
+            items = list(Association.objects.get_descendants(joe, 'parentOf'))
+        self.assertEquals(['Bob', 'Ann', 'Flo'], [p.name for p in items])
+
+        items = Association.objects.get_ancestors(flo, 'parentOf')
+        self.assertEquals(['Joe', 'Sue', 'Ann', 'Jay'],
+                          [p.name for p in items])
+
+        self.assertTrue(Association.objects.is_ancestor(joe, flo, 'parentOf'))
+        self.assertFalse(
+            Association.objects.is_ancestor(flo, joe, 'parentOf'))
+        self.assertFalse(
+            Association.objects.is_ancestor(jay, bob, 'parentOf'))
+
+        with self.assertRaises(AttributeError):
+            Association.objects.get_descendants(joe, 'livesAt')
+
+    def test_incremental(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        # Flo becomes a parent of Bob; a second path Joe->...->Bob
+        assn = Association.objects.define('parentOf', flo, bob)
+        Association.objects.define_many(
+            'parentOf', [(jay, bob), (joe, flo)])
+        incremental = self.rows()
+        AssociationClosure.objects.rebuild(self.kind)
+        self.assertEquals(self.rows(), incremental)
+        self.assertIn((joe.id, bob.id, 3, 1), incremental)
+        self.assertIn((joe.id, bob.id, 2, 1), incremental)
+
+        assn.delete()
+        incremental = self.rows()
+        AssociationClosure.objects.rebuild(self.kind)
+        self.assertEquals(self.rows(), incremental)
+        self.assertNotIn((joe.id, bob.id, 3, 1), incremental)
+        self.assertNotIn((joe.id, bob.id, 2, 1), incremental)
+
+    def test_update(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        # Ann, parent of Flo, becomes a child of Jay instead of Joe
+        assn = Association.objects.get(
+            kind=self.kind, left_id=joe.id, right_id=ann.id)
+        assn.left_id = jay.id
+        assn.save()
+        incremental = self.rows()
+        AssociationClosure.objects.rebuild(self.kind)
+        self.assertEquals(self.rows(), incremental)
+        self.assertNotIn((joe.id, flo.id, 2, 1), incremental)
+        self.assertIn((jay.id, flo.id, 2, 1), incremental)
+
+    def test_cycle(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        with self.assertRaises(ValueError):
+            Association.objects.define('parentOf', flo, joe)
+        with self.assertRaises(ValueError):
+            Association.objects.define_many('parentOf', [(joe, joe)])
+        self.assertFalse(Association.objects.filter(
+            kind=self.kind, left_id=flo.id, right_id=joe.id).exists())
+        self.assertFalse(Association.objects.filter(
+            kind=self.kind, left_id=joe.id, right_id=joe.id).exists())
+
+    def test_closure_kind(self):
+        kind = AssociationKind.objects.get(name='livesAt')
+        kind.closure = True
+        with self.assertRaises(ValueError):
+            kind.save()
+
+    def test_command(self):
+        AssociationClosure.objects.all().delete()
+        call_command('rebuild_closure', stdout=open('/dev/null', 'w'))
+        self.assertEquals(8, len(self.rows()))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_closure', 'livesAt')
+
+
+class NoClosureTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def test_descendants(self):
+        joe = Person.objects.get(name='Joe')
+        items = Association.objects.get_descendants(joe, 'parentOf')
+        self.assertEquals(['Bob', 'Ann', 'Flo'], [p.name for p in items])
+        self.assertFalse(AssociationClosure.objects.exists())
@@ -0,0 +1,156 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from associations.models import Association
+from associations.models import AssociationClosure
+from associations.models import AssociationCount
+from associations.models import AssociationKind
+from tests.models import Address
+from tests.models import Person
+
+
+class CountTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        for kind in AssociationKind.objects.all():
+            kind.counted = True
+            kind.save()
+            AssociationCount.objects.recount(kind)
+        self.persons = Person.objects.all()
+        self.addresses = Address.objects.all()
+        self.children = [2, 0, 2, 1, 1, 0]
+
+    def tearDown(self):
+        pass
+
+    def test_link_count(self):
+        persons = list(self.persons)
+        AssociationKind.objects.resolve('parentOf')
+        with self.assertNumQueries(1):
+            self.assertEquals(2, persons[0].link_count('parentOf'))
+        self.assertEquals(self.children,
+                          [p.link_count('parentOf') for p in persons])
+        self.assertEquals([0, 2, 0, 2, 0, 2],
+                          [p.link_count('parentOf', side='right')
+                           for p in persons])
+        self.assertEquals(
+            3, self.addresses[0].link_count('livesAt', side='right'))
+
+        with self.assertRaises(AttributeError):
+            self.addresses[0].link_count('livesAt')
+
+    def test_maintained(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        assn = Association.objects.define('parentOf', bob, flo)
+        self.assertEquals(1, bob.link_count('parentOf'))
+        self.assertEquals(3, flo.link_count('parentOf', side='right'))
+
+        Association.objects.define_many(
+            'parentOf', [(bob, jay), (flo, jay), (bob, flo)])
+        self.assertEquals(2, bob.link_count('parentOf'))
+        self.assertEquals(2, jay.link_count('parentOf', side='right'))
+
+        assn.delete()
+        self.assertEquals(1, bob.link_count('parentOf'))
+        self.assertEquals(2, flo.link_count('parentOf', side='right'))
+
+    def test_define_atomic(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+
+        def fail(sender, **kwargs):
+            raise RuntimeError('maintenance failed')
+        post_save.connect(fail, sender=Association)
+        try:
+            with self.assertRaises(RuntimeError):
+                Association.objects.define('parentOf', bob, flo)
+        finally:
+            post_save.disconnect(fail, sender=Association)
+        self.assertFalse(Association.objects.filter(
+            left_id=bob.id, right_id=flo.id).exists())
+        self.assertEquals(0, bob.link_count('parentOf'))
+
+    def test_update(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        assn = Association.objects.get_by_objects(
+            AssociationKind.objects.resolve('parentOf'), joe, bob)
+        assn.left_id = jay.id
+        assn.save()
+        self.assertEquals(1, joe.link_count('parentOf'))
+        self.assertEquals(2, jay.link_count('parentOf'))
+        self.assertEquals(2, bob.link_count('parentOf', side='right'))
+
+    def test_annotate(self):
+        AssociationKind.objects.resolve('parentOf')
+        with self.assertNumQueries(1):
+            persons = list(Person.objects.annotate_link_count('parentOf'))
+        self.assertEquals(self.children,
+                          [p.parentOf_count for p in persons])
+
+        addresses = Address.objects.annotate_link_count(
+            'livesAt', side='right', name='residents')
+        self.assertEquals([3, 3], [a.residents for a in addresses])
+
+    def test_command(self):
+        AssociationCount.objects.all().delete()
+        self.assertEquals(0, self.persons[0].link_count('parentOf'))
+        call_command('recount_associations', stdout=open('/dev/null', 'w'))
+        self.assertEquals(2, self.persons[0].link_count('parentOf'))
+
+
+class UncountedTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def test_link_count(self):
+        persons = Person.objects.annotate_link_count('parentOf')
+        self.assertEquals([2, 0, 2, 1, 1, 0],
+                          [p.link_count('parentOf') for p in persons])
+        self.assertEquals([2, 0, 2, 1, 1, 0],
+                          [p.parentOf_count for p in persons])
+        self.assertFalse(AssociationCount.objects.exists())
+
+        with self.assertRaises(CommandError):
+            call_command('recount_associations', 'parentOf')
+
+
+class UndefineTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        for kind in AssociationKind.objects.all():
+            kind.counted = True
+            kind.closure = kind.name == 'parentOf'
+            kind.save()
+            AssociationCount.objects.recount(kind)
+            if kind.closure:
+                AssociationClosure.objects.rebuild(kind)
+        self.persons = Person.objects.all()
+
+    def test_undefine_many(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        Association.objects.undefine_many(
+            'parentOf', [(joe, bob), (sue, bob), (ann, flo)])
+        self.assertEquals(1, joe.link_count('parentOf'))
+        self.assertEquals(0, bob.link_count('parentOf', side='right'))
+        self.assertEquals(1, flo.link_count('parentOf', side='right'))
+        self.assertFalse(
+            Association.objects.is_ancestor(joe, bob, 'parentOf'))
+        self.assertFalse(
+            Association.objects.is_ancestor(joe, flo, 'parentOf'))
+        self.assertTrue(
+            Association.objects.is_ancestor(jay, flo, 'parentOf'))
+
+    def test_unlink_all(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        Association.objects.unlink_all(ann)
+        self.assertEquals(1, joe.link_count('parentOf'))
+        self.assertEquals(1, flo.link_count('parentOf', side='right'))
+        self.assertEquals(
+            2, Address.objects.get(street='213 Church').link_count(
+                'livesAt', side='right'))
+        self.assertEquals(
+            ['Jay'],
+            [p.name for p in Association.objects.get_ancestors(
+                flo, 'parentOf')])
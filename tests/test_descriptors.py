@@ -0,0 +1,77 @@
+from django.db.models import Prefetch
+from django.test import TestCase
+
+from associations.models import Association
+from associations.models import AssociationKind
+from associations.models import LinkedDescriptor
+from associations.registry import register
+from tests.models import Address, Person
+
+
+class DescriptorTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.joe, self.bob, self.sue, self.ann, self.jay, self.flo = \
+            Person.objects.all()
+        self.main, self.church = Address.objects.all()
+        AssociationKind.objects.resolve('parentOf')
+
+    def tearDown(self):
+        pass
+
+    def names(self, items):
+        return [str(item) for item in items]
+
+    def test_attributes(self):
+        self.assertEquals(['Bob', 'Ann'], self.names(self.joe.children.all()))
+        self.assertEquals(['Ann', 'Jay'], self.names(self.flo.parents))
+        self.assertEquals(['123 Main'], self.names(self.joe.livesAt.all()))
+        self.assertEquals(['Joe', 'Bob', 'Sue'],
+                          self.names(self.main.residents.all()))
+        self.assertEquals(2, self.joe.children.count())
+        self.assertEquals(['Ann'], self.names(
+            self.joe.children.filter(name='Ann')))
+        self.assertTrue(isinstance(Person.children, LinkedDescriptor))
+
+    def test_bound_once(self):
+        self.joe.children.all()
+        # no kind lookup and the linked query only
+        with self.assertNumQueries(1):
+            list(self.sue.children.all())
+        # a reloaded kind cache rebinds
+        AssociationKind.objects.clear_cache()
+        with self.assertNumQueries(2):
+            list(self.sue.children.all())
+
+    def test_prefetch_related(self):
+        list(Person.objects.all())
+        with self.assertNumQueries(3):
+            persons = list(Person.objects.prefetch_related('children'))
+            children = dict((str(person), self.names(person.children.all()))
+                            for person in persons)
+        self.assertEquals(['Bob', 'Ann'], children['Joe'])
+        self.assertEquals(['Bob', 'Ann'], children['Sue'])
+        self.assertEquals(['Flo'], children['Jay'])
+        self.assertEquals([], children['Bob'])
+
+        with self.assertNumQueries(3):
+            addresses = list(Address.objects.prefetch_related(Prefetch(
+                'residents', Person.objects.exclude(name='Bob'))))
+            self.assertEquals(['Joe', 'Sue'],
+                              self.names(addresses[0].residents.all()))
+
+    def test_prefetch_associations(self):
+        persons = list(Person.objects.prefetch_associations('parentOf'))
+        with self.assertNumQueries(0):
+            self.assertEquals(['Bob', 'Ann'],
+                              self.names(persons[0].children.all()))
+
+    def test_errors(self):
+        self.assertRaises(AttributeError, LinkedDescriptor,
+                          Person, 'parentOf', 'up', 'up')
+        # addresses are on the right of livesAt
+        homes = LinkedDescriptor(Address, 'livesAt', 'left', 'homes')
+        self.assertRaises(AttributeError, homes.__get__(self.main).all)
+        self.assertRaises(AttributeError, register, Association,
+                          kinds=[('parentOf', 'left', 'kind')])
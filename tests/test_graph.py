@@ -0,0 +1,93 @@
+from django.test import TestCase
+
+from associations.graph import KindGraph
+from associations.models import Association
+from tests.models import Person
+
+
+class GraphTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.persons = list(Person.objects.all())
+        self.ids = dict((p.name, p.id) for p in self.persons)
+
+    def tearDown(self):
+        pass
+
+    def test_load(self):
+        with self.assertNumQueries(1):
+            graph = KindGraph.load('parentOf')
+        self.assertEquals(6, len(graph))
+        for person in self.persons:
+            for side in ('left', 'right'):
+                self.assertEquals(
+                    sorted(p.id for p in person.linked('parentOf', side)),
+                    sorted(graph.neighbours(person.id, side)))
+                self.assertEquals(
+                    person.link_count('parentOf', side),
+                    graph.degree(person.id, side))
+
+    def test_related(self):
+        graph = KindGraph.load('livesAt')
+        for person in self.persons:
+            self.assertEquals(
+                sorted(p.id for p in person.related('livesAt')),
+                sorted(graph.related(person.id)))
+        graph = KindGraph.load('parentOf')
+        self.assertEquals({self.ids['Sue']: 2},
+                          graph.related(self.ids['Joe']))
+
+    def test_bfs(self):
+        graph = KindGraph.load('parentOf')
+        ids = self.ids
+        self.assertEquals({ids['Bob']: 1, ids['Ann']: 1, ids['Flo']: 2},
+                          graph.bfs(ids['Joe']))
+        self.assertEquals({ids['Bob']: 1, ids['Ann']: 1},
+                          graph.bfs(ids['Joe'], max_depth=1))
+        self.assertEquals(
+            {ids['Ann']: 1, ids['Jay']: 1, ids['Joe']: 2, ids['Sue']: 2},
+            graph.bfs(ids['Flo'], side='right'))
+        with self.assertRaises(AttributeError):
+            KindGraph.load('livesAt').bfs(ids['Joe'])
+
+    def test_refresh(self):
+        graph = KindGraph.load('parentOf')
+        joe, flo = self.persons[0], self.persons[5]
+        Association.objects.define('parentOf', flo, joe)
+        with self.assertNumQueries(1):
+            self.assertEquals(1, graph.refresh())
+        self.assertEquals([joe.id], list(graph.neighbours(flo.id)))
+        self.assertEquals(0, graph.refresh())
+        # cycles are safe
+        self.assertEquals(3, len(graph.bfs(joe.id)))
+
+        # merged as a new snapshot would be built
+        persons = self.persons
+        Association.objects.define_many('parentOf', [
+            (persons[1], persons[0]), (persons[1], persons[5]),
+            (persons[4], persons[3])])
+        self.assertEquals(3, graph.refresh())
+        fresh = KindGraph.load('parentOf')
+        for side in ('left', 'right'):
+            for name in ('nodes', 'offsets', 'targets'):
+                self.assertEquals(
+                    getattr(fresh._side(side), name),
+                    getattr(graph._side(side), name))
+
+    def test_top_related(self):
+        graph = KindGraph.load('parentOf')
+        ids = self.ids
+        rows = dict(graph.top_related(side='right', block_size=2))
+        self.assertEquals(
+            {ids['Bob']: [(ids['Ann'], 2)],
+             ids['Ann']: [(ids['Bob'], 2)],
+             ids['Flo']: []}, rows)
+
+        Association.objects.define_many('parentOf', [
+            (self.persons[4], self.persons[1])])
+        graph.refresh()
+        for node, top in graph.top_related(side='left', k=2):
+            expected = Association.objects.get_related_ranked(
+                Person(id=node), 'parentOf', limit=2)
+            self.assertEquals([(p.id, p.shared) for p in expected], top)
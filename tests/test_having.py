@@ -0,0 +1,84 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from associations.models import Association
+from associations.models import AssociationKind
+from associations.models import Linked
+from tests.models import Address, Person
+
+
+class HavingTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.joe, self.bob, self.sue, self.ann, self.jay, self.flo = \
+            Person.objects.all()
+        self.main, self.church = Address.objects.all()
+        AssociationKind.objects.resolve('parentOf')
+        AssociationKind.objects.resolve('livesAt')
+
+    def tearDown(self):
+        pass
+
+    def names(self, qs):
+        return sorted(str(item) for item in qs)
+
+    def test_intersection(self):
+        # parents of both Bob and Ann, counted in one statement
+        with CaptureQueriesContext(connection) as queries:
+            parents = self.names(Association.objects.having(
+                ('parentOf', 'right', self.bob),
+                ('parentOf', 'right', self.ann)))
+        self.assertEquals(['Joe', 'Sue'], parents)
+        self.assertEquals(1, len(queries))
+        self.assertIn('HAVING', queries[0]['sql'])
+
+        self.assertEquals([], self.names(Association.objects.having(
+            ('parentOf', 'right', self.bob),
+            ('parentOf', 'right', self.flo))))
+
+    def test_union(self):
+        parents = Association.objects.having(
+            Linked('parentOf', 'right', self.bob) |
+            Linked('parentOf', 'right', self.flo))
+        self.assertEquals(['Ann', 'Jay', 'Joe', 'Sue'], self.names(parents))
+
+    def test_difference(self):
+        # people living at 123 Main who are not parents
+        with self.assertNumQueries(1):
+            people = self.names(Association.objects.having(
+                ('livesAt', 'right', self.main) &
+                ~Linked('parentOf', 'right')))
+        self.assertEquals(['Bob'], people)
+
+        self.assertEquals(['Ann', 'Bob', 'Flo', 'Jay'],
+                          self.names(Association.objects.having(
+                              ~(Linked('livesAt', 'right', self.main) &
+                                Linked('parentOf', 'right')))))
+
+    def test_mixed_kinds(self):
+        # parents living at 213 Church who are children of Joe
+        people = Association.objects.having(
+            ('parentOf', 'right'),
+            ('livesAt', 'right', self.church),
+            ('parentOf', 'left', self.joe))
+        self.assertEquals(['Ann'], self.names(people))
+
+    def test_querysets_combine(self):
+        parents = Association.objects.having(
+            ('parentOf', 'right', self.bob)) & Association.objects.having(
+            ('livesAt', 'right', self.main))
+        self.assertEquals(['Joe', 'Sue'], self.names(parents))
+
+    def test_errors(self):
+        self.assertRaises(KeyError, Association.objects.having,
+                          ('livesAt', 'left', self.joe),
+                          ('parentOf', 'right', self.bob))
+        self.assertRaises(AttributeError, Association.objects.having,
+                          ('livesAt', 'left', self.main))
+        self.assertRaises(AttributeError, Association.objects.having,
+                          ('parentOf', 'up', self.bob))
+        self.assertRaises(ValueError, Association.objects.having,
+                          'parentOf')
+        self.assertRaises(ValueError, Association.objects.having)
@@ -0,0 +1,106 @@
+import logging
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test import override_settings
+
+from associations.instrumentation import AssociationStatsMiddleware
+from associations.instrumentation import operation_finished
+from associations.instrumentation import record
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Person
+
+hooked = []
+
+
+def hook(**stats):
+    hooked.append(stats)
+
+
+class InstrumentationTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.persons = list(Person.objects.all())
+        AssociationKind.objects.resolve('parentOf')
+        del hooked[:]
+
+    def tearDown(self):
+        pass
+
+    def test_record(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        with record() as stats:
+            Association.objects.define('parentOf', flo, jay)
+            Association.objects.define_many(
+                'parentOf', [(flo, bob), (flo, jay)])
+            list(joe.linked('parentOf'))
+            Association.objects.get_linked_many(self.persons, 'parentOf')
+            Association.objects.undefine_many('parentOf', [(flo, bob)])
+
+        self.assertEquals(
+            ['define', 'define', 'linked', 'linked', 'delete'],
+            [item['operation'] for item in stats])
+        self.assertEquals([1, 2, None, 8, 1],
+                          [item['rows'] for item in stats])
+        self.assertEquals(1, stats[0]['queries'])
+        # the query set of linked runs after the operation
+        self.assertEquals(0, stats[2]['queries'])
+        self.assertEquals(2, stats[3]['queries'])
+        for item in stats:
+            self.assertEquals('default', item['using'])
+            self.assertTrue(item['duration'] >= 0)
+
+    def test_rows(self):
+        joe = self.persons[0]
+        with record() as stats:
+            Association.objects.get_related_summary(joe)
+            Association.objects.get_link_count(joe, 'parentOf')
+        self.assertEquals([('related', 2), ('count', None)],
+                          [(item['operation'], item['rows'])
+                           for item in stats])
+
+    def test_signal(self):
+        received = []
+
+        def receiver(sender, **stats):
+            received.append(stats)
+
+        operation_finished.connect(receiver)
+        try:
+            Association.objects.get_related(self.persons[0], 'livesAt')
+        finally:
+            operation_finished.disconnect(receiver)
+        self.assertEquals(['related'],
+                          [item['operation'] for item in received])
+
+    @override_settings(ASSOCIATIONS_STATS_HOOK=__name__ + '.hook')
+    def test_hook(self):
+        Association.objects.undefine(
+            'parentOf', self.persons[0], self.persons[1])
+        self.assertEquals([('delete', 1)],
+                          [(item['operation'], item['rows'])
+                           for item in hooked])
+
+    def test_middleware(self):
+        persons = self.persons
+
+        def view(request):
+            for person in persons:
+                list(person.linked('parentOf'))
+            return HttpResponse()
+
+        request = RequestFactory().get('/family/')
+        with override_settings(ASSOCIATIONS_STATS_REPEAT_WARNING=5):
+            with self.assertLogs('associations', logging.INFO) as logs:
+                AssociationStatsMiddleware(view)(request)
+        self.assertEquals(6, request.association_stats['linked']['calls'])
+        self.assertEquals(['WARNING'], [r.levelname for r in logs.records])
+        self.assertIn('/family/: linked x6', logs.output[0])
+
+    def test_inactive(self):
+        with self.assertNumQueries(1):
+            Association.objects.define(
+                'parentOf', self.persons[5], self.persons[4])
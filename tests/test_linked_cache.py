@@ -0,0 +1,96 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.test import override_settings
+
+from associations import linked_cache
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Person
+
+
+@override_settings(ASSOCIATIONS_LINKED_CACHE='default')
+class LinkedCacheTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        cache.clear()
+        linked_cache.reset_stats()
+        self.persons = list(Person.objects.all())
+        AssociationKind.objects.resolve('parentOf')
+
+    def tearDown(self):
+        cache.clear()
+
+    def names(self, obj, kind='parentOf', side='left'):
+        return [p.name for p in obj.linked(kind, side=side)]
+
+    def test_hit(self):
+        joe = self.persons[0]
+        with self.assertNumQueries(2):
+            self.assertEquals(['Bob', 'Ann'], self.names(joe))
+        # the linked ids come from the cache
+        with self.assertNumQueries(1):
+            self.assertEquals(['Bob', 'Ann'], self.names(joe))
+        self.assertEquals(dict(hits=1, misses=1, invalidations=0),
+                          linked_cache.stats())
+
+    def test_invalidate_define(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        self.assertEquals(['Bob', 'Ann'], self.names(joe))
+        self.assertEquals(['Ann', 'Jay'], self.names(flo, side='right'))
+        Association.objects.define('parentOf', joe, flo)
+        self.assertEquals(['Bob', 'Ann', 'Flo'], self.names(joe))
+        self.assertEquals(['Joe', 'Ann', 'Jay'],
+                          self.names(flo, side='right'))
+
+        Association.objects.define_many('parentOf', [(joe, jay)])
+        self.assertEquals(['Bob', 'Ann', 'Jay', 'Flo'], self.names(joe))
+
+    def test_invalidate_update(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        self.assertEquals(['Bob', 'Ann'], self.names(joe))
+        self.assertEquals(['Flo'], self.names(jay))
+        assn = Association.objects.get_by_objects(
+            AssociationKind.objects.resolve('parentOf'), joe, bob)
+        assn.left_id = jay.id
+        assn.save()
+        self.assertEquals(['Ann'], self.names(joe))
+        self.assertEquals(['Bob', 'Flo'], self.names(jay))
+
+    def test_invalidate_delete(self):
+        joe, bob, sue, ann, jay, flo = self.persons
+        self.assertEquals(['Bob', 'Ann'], self.names(joe))
+        Association.objects.get_by_objects(
+            AssociationKind.objects.resolve('parentOf'), joe, bob).delete()
+        self.assertEquals(['Ann'], self.names(joe))
+
+        Association.objects.undefine_many('parentOf', [(joe, ann)])
+        self.assertEquals([], self.names(joe))
+
+        self.assertEquals(['Flo'], self.names(ann))
+        flo.delete()
+        self.assertEquals([], self.names(ann))
+
+    async def test_async(self):
+        joe = self.persons[0]
+        items = await Association.objects.aget_linked(joe, 'parentOf')
+        self.assertEquals(['Bob', 'Ann'], [p.name async for p in items])
+        items = await joe.alinked('parentOf')
+        self.assertEquals(['Bob', 'Ann'], [p.name async for p in items])
+        self.assertEquals(dict(hits=1, misses=1, invalidations=0),
+                          linked_cache.stats())
+
+    def test_prefetch_associations(self):
+        with self.assertNumQueries(3):
+            persons = list(Person.objects.prefetch_associations('parentOf'))
+        with self.assertNumQueries(0):
+            self.assertEquals(['Bob', 'Ann'],
+                              [p.name for p in persons[0].linked('parentOf')])
+        self.assertEquals(dict(hits=0, misses=0, invalidations=0),
+                          linked_cache.stats())
+
+    def test_disabled(self):
+        with override_settings(ASSOCIATIONS_LINKED_CACHE=None):
+            self.assertEquals(['Bob', 'Ann'], self.names(self.persons[0]))
+        self.assertEquals(dict(hits=0, misses=0, invalidations=0),
+                          linked_cache.stats())
@@ -1,5 +1,6 @@
 from django.test import TestCase
 
+from associations.models import Association
 from associations.models import AssociationKind
 from tests.models import Person
 from tests.models import Address
@@ -53,3 +54,38 @@ class ModelsTest(TestCase):
             q = self.persons[i].related('parentOf', side='right')
             items = [item for item in q]
             self.assertEquals(results[i], len(items))
+
+    def test_linked_many(self):
+        persons = list(self.persons)
+        AssociationKind.objects.resolve('parentOf')
+        with self.assertNumQueries(2):
+            linked = Association.objects.get_linked_many(
+                persons, 'parentOf')
+        self.assertEquals(self.children,
+                          [len(linked[p.id]) for p in persons])
+        self.assertEquals(['Bob', 'Ann'],
+                          [p.name for p in linked[persons[0].id]])
+
+        parents = Association.objects.get_linked_many(
+            persons, 'parentOf', side='right')
+        self.assertEquals([0, 2, 0, 2, 0, 2],
+                          [len(parents[p.id]) for p in persons])
+
+        with self.assertRaises(AttributeError):
+            Association.objects.get_linked_many(
+                list(self.addresses), 'parentOf')
+
+    def test_prefetch_associations(self):
+        AssociationKind.objects.resolve('parentOf')
+        with self.assertNumQueries(5):
+            persons = list(Person.objects.prefetch_associations(
+                'parentOf', ('livesAt', 'left')))
+        with self.assertNumQueries(0):
+            for i in range(len(persons)):
+                self.assertEquals(self.children[i],
+                                  len(persons[i].linked('parentOf')))
+                self.assertEquals(1, len(persons[i].linked('livesAt')))
+        # other sides are not prefetched
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                0, len(persons[0].linked('parentOf', side='right')))
@@ -0,0 +1,62 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Address
+from tests.models import Person
+
+
+class OrphanTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.persons = Person.objects.all()
+
+    def tearDown(self):
+        pass
+
+    def test_delete_unlinks(self):
+        ann = self.persons[3]
+        ann_id = ann.id
+        ann.delete()
+        self.assertFalse(Association.objects.filter(
+            left_type__model='person', left_id=ann_id).exists())
+        self.assertFalse(Association.objects.filter(
+            right_type__model='person', right_id=ann_id).exists())
+        self.assertEquals(8, Association.objects.count())
+
+    def test_delete_unlinks_new_kind(self):
+        ann = self.persons[3]
+        parentOf = AssociationKind.objects.resolve('parentOf')
+        # defined by another process: no signal clears the kind cache
+        AssociationKind.objects.bulk_create([AssociationKind(
+            name='friendOf', left_type_id=parentOf.left_type_id,
+            right_type_id=parentOf.right_type_id)])
+        kind = AssociationKind.objects.get(name='friendOf')
+        Association.objects.bulk_create([Association(
+            kind=kind, left_type_id=kind.left_type_id,
+            right_type_id=kind.right_type_id, left_id=ann.id,
+            right_id=self.persons[0].id)])
+        ann.delete()
+        self.assertFalse(Association.objects.filter(kind=kind).exists())
+
+    def test_sweep(self):
+        # delete bypassing the signals to leave orphans behind
+        Person.objects.filter(name__in=['Ann', 'Flo'])._raw_delete('default')
+        Address.objects.filter(street='213 Church')._raw_delete('default')
+        # Ann has 4 links, Flo 2 more and Church 1 more (Jay)
+        self.assertEquals(12, Association.objects.count())
+
+        out = StringIO()
+        call_command('sweep_associations', '--dry-run', chunk_size=2,
+                     stdout=out)
+        self.assertIn('parentOf left: 1 orphans', out.getvalue())
+        self.assertEquals(12, Association.objects.count())
+
+        call_command('sweep_associations', chunk_size=2, stdout=out)
+        self.assertEquals(12 - 7, Association.objects.count())
+        self.assertEquals(0, Association.objects.delete_orphans(
+            'livesAt', 'right'))
@@ -0,0 +1,80 @@
+from django.test import TestCase
+
+from associations.instrumentation import record
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Address, Person
+
+
+class PaginationTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.persons = list(Person.objects.all())
+        self.main, self.church = Address.objects.all()
+        AssociationKind.objects.resolve('livesAt')
+
+    def tearDown(self):
+        pass
+
+    def names(self, items):
+        return [str(item) for item in items]
+
+    def test_iter_linked(self):
+        for chunk_size in (1, 2, 3, 10):
+            self.assertEquals(
+                ['Joe', 'Bob', 'Sue'],
+                self.names(self.main.iter_linked(
+                    'livesAt', 'right', chunk_size=chunk_size)))
+
+        # one query per chunk for the ids and one for the items
+        with self.assertNumQueries(4):
+            list(self.main.iter_linked('livesAt', 'right', chunk_size=2))
+        self.assertEquals(['123 Main'], self.names(
+            self.persons[0].iter_linked('livesAt')))
+
+    def test_iter_linked_skips_deleted(self):
+        Person.objects.filter(name='Bob')._raw_delete('default')
+        self.assertEquals(['Joe', 'Sue'], self.names(
+            self.main.iter_linked('livesAt', 'right', chunk_size=1)))
+
+    def test_pages(self):
+        pages = []
+        cursor = None
+        while True:
+            items, cursor = self.main.linked_page(
+                'livesAt', 'right', size=2, cursor=cursor)
+            pages.append(self.names(items))
+            if cursor is None:
+                break
+        self.assertEquals([['Joe', 'Bob'], ['Sue']], pages)
+
+        items, cursor = self.main.linked_page('livesAt', 'right', size=3)
+        self.assertEquals(3, len(items))
+        self.assertEquals(None, cursor)
+
+    def test_bad_cursor(self):
+        items, cursor = self.main.linked_page('livesAt', 'right', size=1)
+        self.assertRaises(ValueError, self.main.linked_page,
+                          'livesAt', 'right', cursor=cursor + 'x')
+        # a cursor is bound to its instance, kind and side
+        self.assertRaises(ValueError, self.church.linked_page,
+                          'livesAt', 'right', cursor=cursor)
+        self.assertRaises(ValueError, Association.objects.get_linked_page,
+                          self.persons[0], 'parentOf', 'left',
+                          cursor=cursor)
+        self.assertRaises(AttributeError, self.main.linked_page,
+                          'livesAt', 'left')
+        self.assertRaises(ValueError, self.main.linked_page,
+                          'livesAt', 'right', size=0)
+        self.assertRaises(ValueError, list, self.main.iter_linked(
+            'livesAt', 'right', chunk_size=0))
+
+    def test_record(self):
+        with record() as stats:
+            items, cursor = self.main.linked_page('livesAt', 'right',
+                                                  size=2)
+        self.assertEquals(['Joe', 'Bob'], self.names(items))
+        self.assertEquals([('linked', 2)],
+                          [(item['operation'], item['rows'])
+                           for item in stats])
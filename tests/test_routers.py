@@ -0,0 +1,92 @@
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from associations import routers
+from associations.instrumentation import record
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Address, Person
+
+
+@override_settings(
+    DATABASE_ROUTERS=['associations.routers.AssociationRouter'],
+    ASSOCIATIONS_READ_DB='replica')
+class RouterTest(TransactionTestCase):
+    # the replica mirrors default on another connection, which only
+    # sees committed data
+    databases = {'default', 'replica'}
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.joe, self.bob, self.sue, self.ann, self.jay, self.flo = \
+            Person.objects.all()
+        self.main = Address.objects.all()[0]
+        AssociationKind.objects.resolve('parentOf')
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_go_to_replica(self):
+        self.assertEquals('replica', Association.objects.db)
+        self.assertEquals('replica', self.joe.linked('parentOf').db)
+        self.assertEquals('replica', self.joe.related('parentOf').db)
+        self.assertEquals('replica', Association.objects.traverse(
+            self.joe, [('parentOf', 'left')]).db)
+        self.assertEquals('replica', Association.objects.having(
+            ('parentOf', 'right', self.bob)).db)
+        self.assertEquals('replica', self.joe.children.all().db)
+        # models of other apps are left to the other routers
+        self.assertEquals('default', Person.objects.db)
+
+        with CaptureQueriesContext(connections['replica']) as queries:
+            children = [str(p) for p in self.joe.linked('parentOf')]
+        self.assertEquals(['Bob', 'Ann'], children)
+        self.assertEquals(1, len(queries))
+
+    def test_using(self):
+        self.assertEquals('default', Association.objects.get_linked(
+            self.joe, 'parentOf', 'left', using='default').db)
+        self.assertEquals('default', Association.objects.get_related(
+            self.joe, 'parentOf', using='default').db)
+        self.assertEquals('default', Association.objects.traverse(
+            self.joe, [('parentOf', 'left')], max_depth=2,
+            using='default').db)
+        self.assertEquals(2, Association.objects.get_link_count(
+            self.joe, 'parentOf', using='default'))
+        self.assertEquals(self.joe.id, Association.objects.get_by_objects(
+            AssociationKind.objects.resolve('parentOf'), self.joe, self.bob,
+            using='default').left_id)
+
+        with record() as stats:
+            Association.objects.get_linked_many(
+                [self.joe, self.sue], 'parentOf', using='default')
+        self.assertEquals([('default', 2)],
+                          [(item['using'], item['queries'])
+                           for item in stats])
+
+    def test_writes_go_to_primary(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            Association.objects.define('parentOf', self.flo, self.bob)
+            Association.objects.define_many(
+                'parentOf', [(self.flo, self.sue)])
+            Association.objects.undefine('parentOf', self.flo, self.bob)
+        self.assertTrue(len(queries) >= 3)
+
+    def test_read_your_writes(self):
+        Association.objects.define('parentOf', self.flo, self.bob)
+        # reads follow the write to the primary for the window
+        self.assertEquals('default', self.flo.linked('parentOf').db)
+        self.assertEquals(['Bob'], [str(p) for p in self.flo.children])
+        routers.unpin()
+        self.assertEquals('replica', self.flo.linked('parentOf').db)
+
+        with override_settings(ASSOCIATIONS_READ_YOUR_WRITES=0):
+            Association.objects.undefine('parentOf', self.flo, self.bob)
+            self.assertEquals('replica', self.flo.linked('parentOf').db)
+
+    def test_no_replica(self):
+        with override_settings(ASSOCIATIONS_READ_DB=None):
+            self.assertEquals('default', self.joe.linked('parentOf').db)
@@ -0,0 +1,89 @@
+import importlib
+import io
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from django.test import override_settings
+
+from associations.management.commands.partition_associations import Command
+from associations.models import Association
+from associations.models import AssociationKind
+from tests.models import Person
+
+
+class StorageTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.kind = AssociationKind.objects.resolve('parentOf')
+        self.joe, self.bob = Person.objects.all()[:2]
+
+    def tearDown(self):
+        pass
+
+    def test_unique_per_kind(self):
+        association = Association(kind=self.kind,
+                                  left_type_id=self.kind.left_type_id,
+                                  right_type_id=self.kind.right_type_id,
+                                  left_id=self.joe.id,
+                                  right_id=self.bob.id)
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, association.save)
+
+    def test_big_ids(self):
+        big = Person(id=2 ** 40, name='Big')
+        Association.objects.define('parentOf', big, self.bob)
+        self.assertEquals([2 ** 40], list(Association.objects.filter(
+            kind=self.kind, right_id=self.bob.id, left_id__gt=2 ** 32
+        ).values_list('left_id', flat=True)))
+
+    def test_migration_checks(self):
+        normalize = importlib.import_module(
+            'associations.migrations.0005_normalize_associations').normalize
+
+        class Editor(object):
+            connection = connection
+        normalize(apps, Editor())
+
+        livesAt = AssociationKind.objects.resolve('livesAt')
+        ids = sorted(Association.objects.filter(
+            kind=self.kind, left_id=self.joe.id).values_list(
+                'id', flat=True))
+        Association.objects.filter(id__in=ids).update(
+            left_type_id=livesAt.right_type_id)
+        with self.assertRaisesRegex(ValueError, r'2 have .* \(ids %d, %d\)'
+                                    % tuple(ids)):
+            normalize(apps, Editor())
+        self.assertEquals(2, Association.objects.filter(
+            left_type_id=livesAt.right_type_id, kind=self.kind).count())
+
+        with override_settings(ASSOCIATIONS_MIGRATE_FIX=True):
+            with self.assertLogs('associations', 'WARNING') as logs:
+                normalize(apps, Editor())
+        self.assertIn('%d, %d' % tuple(ids), logs.output[0])
+        self.assertFalse(Association.objects.filter(
+            left_type_id=livesAt.right_type_id, kind=self.kind).exists())
+
+    def test_partition_needs_postgresql(self):
+        self.assertRaises(CommandError, call_command,
+                          'partition_associations', stdout=io.StringIO())
+
+    def test_partition_sql(self):
+        kinds = AssociationKind.objects.order_by('id')
+        statements = Command().convert_sql(connection, kinds)
+        self.assertEquals(
+            'CREATE TABLE "associations_association_1" PARTITION OF '
+            '"associations_association" FOR VALUES IN (1)', statements[2])
+        self.assertIn(
+            'ALTER TABLE "associations_association" ADD PRIMARY KEY '
+            '("kind_id", "id")', statements)
+
+        existing = set(['associations_association_1'])
+        statements = Command().add_sql(connection, kinds, existing)
+        self.assertEquals(4, len(statements))
+        self.assertEquals(
+            'ALTER TABLE "associations_association" ATTACH PARTITION '
+            '"associations_association_2" FOR VALUES IN (2)', statements[3])
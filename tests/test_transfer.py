@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from associations.models import Association
+from tests.models import Person
+
+
+class TransferTest(TestCase):
+    fixtures = ['tests', 'associations', ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pairs = self.all_pairs()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def all_pairs(self):
+        return sorted(Association.objects.values_list(
+            'kind__name', 'left_id', 'right_id'))
+
+    def export(self, *args):
+        path = os.path.join(self.dir, 'export')
+        call_command('export_associations', *args, output=path,
+                     chunk_size=5, stderr=StringIO())
+        return path
+
+    def load(self, path, *args, **kwargs):
+        out = StringIO()
+        call_command('import_associations', path, *args, stdout=out,
+                     **kwargs)
+        return out.getvalue()
+
+    def test_ndjson(self):
+        path = self.export()
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEquals(12, len(lines))
+        self.assertEquals(dict(kind='parentOf', left=1, right=2), lines[0])
+
+        Association.objects.all().delete()
+        self.assertIn('12 associations created', self.load(path))
+        self.assertEquals(self.pairs, self.all_pairs())
+        self.assertIn('0 associations created, 12 already present',
+                      self.load(path))
+
+    def test_csv(self):
+        path = self.export('livesAt', '--format', 'csv')
+        Association.objects.all().delete()
+        self.load(path, format='csv', batch_size=4)
+        self.assertEquals(
+            [pair for pair in self.pairs if pair[0] == 'livesAt'],
+            self.all_pairs())
+
+    def test_after_id(self):
+        path = self.export('--after-id', '10')
+        with open(path) as f:
+            self.assertEquals(2, len(f.readlines()))
+
+    def test_checkpoint(self):
+        path = self.export()
+        checkpoint = os.path.join(self.dir, 'checkpoint')
+        # pretend the first five lines were loaded before a failure
+        with open(checkpoint, 'w') as f:
+            f.write('5\n')
+        Association.objects.all().delete()
+        self.assertIn('7 associations created',
+                      self.load(path, checkpoint=checkpoint, batch_size=3))
+        with open(checkpoint) as f:
+            self.assertEquals('12', f.read().strip())
+        self.assertIn('0 associations created, 0 already present',
+                      self.load(path, checkpoint=checkpoint))
+
+    def test_natural(self):
+        Person.natural_key = lambda self: (self.name, )
+        Person.objects.get_by_natural_key = \
+            lambda name: Person.objects.get(name=name)
+        try:
+            path = self.export('parentOf', '--natural')
+            with open(path) as f:
+                first = json.loads(f.readline())
+            self.assertEquals(
+                dict(kind='parentOf', left=['Joe'], right=['Bob']), first)
+            Association.objects.all().delete()
+            self.load(path)
+        finally:
+            del Person.natural_key
+            del Person.objects.get_by_natural_key
+        self.assertEquals(
+            [pair for pair in self.pairs if pair[0] == 'parentOf'],
+            self.all_pairs())
+
+    def test_natural_batched(self):
+        looked_up = []
+
+        def get_by_natural_key(name):
+            looked_up.append(name)
+            return Person.objects.get(name=name)
+
+        def in_bulk_by_natural_key(keys):
+            looked_up.append(len(keys))
+            return dict(((person.name, ), person) for person in
+                        Person.objects.filter(name__in=[
+                            name for name, in keys]))
+        Person.natural_key = lambda self: (self.name, )
+        Person.objects.get_by_natural_key = get_by_natural_key
+        try:
+            path = self.export('parentOf', '--natural')
+            Association.objects.all().delete()
+            # each distinct key once per batch
+            self.load(path, batch_size=4)
+            self.assertEquals(['Ann', 'Bob', 'Flo', 'Jay', 'Joe', 'Sue'],
+                              sorted(set(looked_up)))
+            self.assertEquals(7, len(looked_up))
+
+            looked_up[:] = []
+            Person.objects.in_bulk_by_natural_key = in_bulk_by_natural_key
+            Association.objects.all().delete()
+            self.load(path, batch_size=4)
+            self.assertEquals([4, 3], looked_up)
+        finally:
+            del Person.natural_key
+            del Person.objects.get_by_natural_key
+            del Person.objects.in_bulk_by_natural_key
+        self.assertEquals(
+            [pair for pair in self.pairs if pair[0] == 'parentOf'],
+            self.all_pairs())
+
+    def test_orphans(self):
+        Person.natural_key = lambda self: (self.name, )
+        try:
+            # deleted without the signal that unlinks it
+            Person.objects.filter(name='Flo')._raw_delete('default')
+            err = StringIO()
+            path = os.path.join(self.dir, 'export')
+            call_command('export_associations', 'parentOf', '--natural',
+                         output=path, stderr=err)
+        finally:
+            del Person.natural_key
+        self.assertIn('skipped 2 associations of deleted items',
+                      err.getvalue())
+        with open(path) as f:
+            self.assertEquals(4, len(f.readlines()))
+
+        with open(path, 'w') as f:
+            f.write('{"kind": "parentOf", "left": 1, "right": null}\n')
+        with self.assertRaisesRegex(CommandError, 'line 1: None is not'):
+            self.load(path)